@@ -0,0 +1,239 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import hashlib
+import struct
+import bisect
+import datetime
+from array import array
+
+import timesource
+
+NO_EVENT = -1  # polar day or night
+
+_MAGIC = b'PCAS'
+_VERSION = 1
+_header = struct.Struct('<4sHHddH')
+_transition = struct.Struct('<qi')
+
+
+def _pack_str(s):
+    data = s.encode('utf-8')
+    return struct.pack('<B', len(data)) + data
+
+
+def _unpack_str(data, offset):
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode('utf-8'), offset + 1 + length
+
+
+def _local_zone():
+    return '/'.join(time.tzname)
+
+
+def _event_time(event, observer, date, tz):
+    try:
+        return int(event(observer, date=date, tzinfo=tz).timestamp())
+    except ValueError:
+        return NO_EVENT
+
+
+def _offset(tz, ts):
+    local = datetime.datetime.fromtimestamp(ts, tz)
+    return int(local.utcoffset().total_seconds()), local.tzname()
+
+
+class TimezoneTable:
+    """UTC offset transitions of the timezone during the year"""
+
+    def __init__(self, name, starts, offsets):
+        self.name = name
+        self.starts = starts
+        self.offsets = offsets
+
+    @classmethod
+    def compute(cls, name, year):
+        from pytz import timezone
+        tz = timezone(name)
+        ts = int(datetime.datetime(year, 1, 1,
+                                   tzinfo=datetime.timezone.utc).timestamp())
+        end = int(datetime.datetime(year + 1, 1, 1,
+                                    tzinfo=datetime.timezone.utc).timestamp())
+        current = _offset(tz, ts)
+        starts = [ts]
+        offsets = [current]
+        while ts < end:
+            next_ts = ts + 86400
+            offset = _offset(tz, next_ts)
+            if offset != current:
+                # transition happened during this day, find exact second
+                lo, hi = ts, next_ts
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if _offset(tz, mid) == current:
+                        lo = mid
+                    else:
+                        hi = mid
+                current = offset
+                starts.append(hi)
+                offsets.append(offset)
+            ts = next_ts
+        return cls(name, starts, offsets)
+
+    def tzinfo(self, ts):
+        index = bisect.bisect_right(self.starts, ts) - 1
+        offset, abbreviation = self.offsets[max(index, 0)]
+        return datetime.timezone(datetime.timedelta(seconds=offset), abbreviation)
+
+
+class Astronomy:
+    """Sunrise and sunset times for every day of the year at the given position and
+       UTC offset transitions for the given timezones.
+
+       Tables are computed once per year and stored in cache_dir, stored tables are
+       used only if position, year and timezones match"""
+
+    def __init__(self, position, timezones, cache_dir=None):
+        self.lat = round(position['lat'], 4)
+        self.lon = round(position['lon'], 4)
+        self.timezones = [tz for tz in timezones if tz is not None]
+        self.cache_dir = cache_dir
+        self.year = None
+        self.sun_times = None
+        self.zones = {}
+
+    def sun(self, date):
+        """Returns tuple of local sunrise and sunset datetime, None if the event doesn't happen on this date"""
+        self._ensure_year(date.year)
+        index = (date.toordinal() -
+                 datetime.date(date.year, 1, 1).toordinal()) * 2
+        return tuple(None if ts == NO_EVENT else datetime.datetime.fromtimestamp(ts)
+                     for ts in self.sun_times[index:index + 2])
+
+    def now(self, tz_name, ts=None):
+        """Returns current time in the timezone"""
+        if ts is None:
+            ts = timesource.time()
+        self._ensure_year(datetime.datetime.fromtimestamp(ts).year)
+        zone = self.zones.get(tz_name, None)
+        if zone is not None:
+            tz = zone.tzinfo(ts)
+        else:
+            from pytz import timezone
+            tz = timezone(tz_name)
+        return datetime.datetime.fromtimestamp(ts, tz)
+
+    def _path(self, year):
+        if self.cache_dir is None:
+            return None
+        # every position and set of timezones has its own file, so displays don't overwrite each other's tables
+        zones = hashlib.sha1(
+            ','.join(sorted(self.timezones)).encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f'astronomy-{year}-{self.lat}-{self.lon}-{zones}.bin')
+
+    def _ensure_year(self, year):
+        if self.year == year:
+            return
+        path = self._path(year)
+        try:
+            self._load(path, year)
+        except Exception as ex:
+            print(f'Computing astronomy tables for {year}: {ex}')
+            self._compute(year)
+            if path is not None:
+                try:
+                    self._save(path)
+                except OSError as ex:
+                    print(f'Failed to save astronomy tables: {ex}')
+
+    def _compute(self, year):
+        # solar calculations are needed only when tables are not cached
+        from dateutil.tz import tzlocal
+        from astral import Observer
+        from astral.sun import sunrise, sunset
+
+        observer = Observer(latitude=self.lat, longitude=self.lon)
+        tz = tzlocal()
+        sun_times = array('q')
+        date = datetime.date(year, 1, 1)
+        while date.year == year:
+            sun_times.append(_event_time(sunrise, observer, date, tz))
+            sun_times.append(_event_time(sunset, observer, date, tz))
+            date += datetime.timedelta(days=1)
+        self.sun_times = sun_times
+        self.zones = {name: TimezoneTable.compute(name, year)
+                      for name in self.timezones}
+        self.year = year
+
+    def _load(self, path, year):
+        if path is None:
+            raise ValueError('cache is disabled')
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, file_year, lat, lon, days = _header.unpack_from(data, 0)
+        offset = _header.size
+        local_zone, offset = _unpack_str(data, offset)
+        if (magic, version, file_year, lat, lon, local_zone) != (_MAGIC, _VERSION, year, self.lat, self.lon, _local_zone()):
+            raise ValueError(f'{path} was computed for another location')
+        sun_times = array('q')
+        sun_times.frombytes(data[offset:offset + days * 2 * sun_times.itemsize])
+        offset += days * 2 * sun_times.itemsize
+
+        zones = {}
+        count = data[offset]
+        offset += 1
+        for _ in range(count):
+            name, offset = _unpack_str(data, offset)
+            transitions = struct.unpack_from('<H', data, offset)[0]
+            offset += 2
+            starts = []
+            offsets = []
+            for _ in range(transitions):
+                start, utc_offset = _transition.unpack_from(data, offset)
+                abbreviation, offset = _unpack_str(
+                    data, offset + _transition.size)
+                starts.append(start)
+                offsets.append((utc_offset, abbreviation))
+            zones[name] = TimezoneTable(name, starts, offsets)
+        if sorted(zones.keys()) != sorted(self.timezones):
+            raise ValueError(f'{path} was computed for other timezones')
+
+        self.sun_times = sun_times
+        self.zones = zones
+        self.year = year
+
+    def _save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_header.pack(_MAGIC, _VERSION, self.year,
+                                 self.lat, self.lon, len(self.sun_times) // 2))
+            f.write(_pack_str(_local_zone()))
+            f.write(self.sun_times.tobytes())
+            f.write(struct.pack('<B', len(self.zones)))
+            for zone in self.zones.values():
+                f.write(_pack_str(zone.name))
+                f.write(struct.pack('<H', len(zone.starts)))
+                for start, (utc_offset, abbreviation) in zip(zone.starts, zone.offsets):
+                    f.write(_transition.pack(start, utc_offset))
+                    f.write(_pack_str(abbreviation))
+        os.replace(tmp, path)
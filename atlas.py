@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Icon atlas: all icons converted to 1-bit and packed into one file, together with
+# the wind arrow pre-rotated in fixed steps. Build it with
+#
+#    ./atlas.py [--step 5] [--output data/icons.atlas]
+
+import os
+import sys
+import mmap
+import glob
+import struct
+import argparse
+
+from PIL import Image
+
+ATLAS_PATH = 'data/icons.atlas'
+WIND_ICON = 'weather/wind'
+
+_MAGIC = b'PCIA'
+_VERSION = 1
+_header = struct.Struct('<4sHHH')
+_entry = struct.Struct('<IHH')
+
+
+def wind_name(angle):
+    return f'{WIND_ICON}@{angle}'
+
+
+def _load_icons(step):
+    """Converts icons exactly the way Resources does"""
+    icons = {}
+    for path in sorted(glob.glob('data/weather/*.png')):
+        name = os.path.splitext(os.path.relpath(path, 'data'))[0]
+        icons[name] = Image.open(path).convert(mode='1')
+    for name in ('sunrise', 'sunset'):
+        icons[name] = Image.open(f'data/{name}.png').convert(
+            mode='1', dither=None)
+    wind = icons[WIND_ICON]
+    for angle in range(0, 360, step):
+        icons[wind_name(angle)] = wind.rotate(angle, fillcolor=1)
+    return icons
+
+
+def build(path=ATLAS_PATH, step=5):
+    icons = _load_icons(step)
+    index = bytearray()
+    data = bytearray()
+    for name, icon in icons.items():
+        encoded = name.encode('utf-8')
+        index += struct.pack('<B', len(encoded)) + encoded
+        index += _entry.pack(len(data), *icon.size)
+        data += icon.tobytes()
+    header = _header.pack(_MAGIC, _VERSION, len(icons), step)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(struct.pack('<I', len(index)))
+        f.write(index)
+        f.write(data)
+    os.replace(tmp, path)
+    return len(icons)
+
+
+class Atlas:
+    """Memory mapped icon atlas"""
+
+    def __init__(self, path=ATLAS_PATH):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.step = _header.unpack_from(self.map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f'{path} is not an icon atlas')
+        offset = _header.size
+        index_size = struct.unpack_from('<I', self.map, offset)[0]
+        offset += 4
+        data_start = offset + index_size
+        self.index = {}
+        for _ in range(count):
+            length = self.map[offset]
+            name = self.map[offset + 1:offset + 1 + length].decode('utf-8')
+            offset += 1 + length
+            data_offset, w, h = _entry.unpack_from(self.map, offset)
+            offset += _entry.size
+            self.index[name] = (data_start + data_offset, w, h)
+        self.view = memoryview(self.map)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def raw(self, name):
+        """Returns 1-bit rows of the icon as a slice of the mapped file, without copying"""
+        offset, w, h = self.index[name]
+        return self.view[offset:offset + (w + 7) // 8 * h]
+
+    def icon(self, name) -> Image:
+        _, w, h = self.index[name]
+        return Image.frombytes('1', (w, h), self.raw(name))
+
+    def wind(self, direction) -> Image:
+        angle = int(round(direction / self.step)) * self.step % 360
+        return self.icon(wind_name(angle))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build icon atlas')
+    parser.add_argument('--step', type=int, default=5,
+                        help='wind arrow rotation step in degrees')
+    parser.add_argument('--output', default=ATLAS_PATH)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    count = build(args.output, args.step)
+    print(f'{count} icons written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
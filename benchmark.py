@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Times every stage of the frame rendering on the headless panel.
+#
+#    ./benchmark.py --output bench.json
+#    ./benchmark.py --baseline bench.json --threshold 1.25
+#
+# Exit code is 1 if any stage is slower than baseline by more than threshold
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+
+from settings import Settings
+from resources import Resources
+from display import Display, Layout
+from openweathermap import WeatherInfo
+
+SAMPLE_PAYLOAD = 'data/onecall-sample.json'
+
+bench_config = {
+    "location": {"lat": 43.65, "lon": -79.38},
+    "secondTZ": "Europe/Athens",
+    "openweathermap_api_key": None,
+    "units": "metric",
+    "time": "24h",
+    "display": {"backend": "headless"}
+}
+
+
+def measure(func, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
+
+
+def stages(payload):
+    """Returns list of (name, function, setup) for every benchmarked stage"""
+    settings = Settings(bench_config)
+    display = Display(settings)
+    layout = Layout(display, settings)
+    layout.weather.update(WeatherInfo(payload))
+    clock = layout.clock
+    weather = layout.weather
+    width = display.width()
+
+    def new_frame():
+        display.new_screen()
+
+    def force_refresh():
+        # make every draw go through the full panel cycle
+        display.last_hashes = (None, None)
+        display.last_refresh_start = datetime.datetime.fromtimestamp(0)
+
+    def draw(state):
+        def func():
+            weather.state = state
+            layout.draw()
+        return func
+
+    display.new_screen()
+    layout.draw()
+    black, red = display.buffers[2], display.buffers[3]
+
+    def parse():
+        info = WeatherInfo(payload)
+        return info.current, info.hourly, info.minutely_precipitation, info.daily, info.alerts
+
+    def getbuffer():
+        display.eInk.getbuffer(black, display.BLACK)
+        display.eInk.getbuffer(red, display.RED)
+
+    return [
+        ('resources', lambda: Resources().preload(), None),
+        ('weather_info.parse', parse, None),
+        ('layout.draw.default', draw(weather.DEFAULT), force_refresh),
+        ('layout.draw.current_details',
+         draw(weather.CURRENT_DETAILS), force_refresh),
+        ('clock.draw_analog_time', lambda: clock.draw_analog_time(
+            (clock.OFFSET, clock.OFFSET), clock.CLOCK_FACE), new_frame),
+        ('clock.draw_current_date',
+         lambda: clock.draw_current_date((95, 0), width - 95), new_frame),
+        ('clock.draw_sun', lambda: clock.draw_sun((95, 30), width - 95), new_frame),
+        ('clock.draw_current_time_other_tz', lambda: clock.draw_current_time_other_tz(
+            (95, 50), width - 95, font=clock.res.tiny_font, vertical=False), new_frame),
+        ('clock.draw_time_data', clock.draw_time_data, new_frame),
+        ('weather.draw_hourly_pop', lambda: weather.draw_hourly_pop(
+            (0, display.height() - 15), width - 65, 15), new_frame),
+        ('weather.draw_wind', lambda: weather.draw_wind(
+            (width - 65, 99), 65), new_frame),
+        ('weather.draw_current_weather',
+         weather.draw_current_weather, new_frame),
+        ('weather.draw_current_details',
+         weather.draw_current_details, new_frame),
+        ('eink.getbuffer', getbuffer, None),
+    ]
+
+
+def run(repeat, only=None):
+    with open(SAMPLE_PAYLOAD) as f:
+        payload = json.load(f)
+    results = {}
+    for name, func, setup in stages(payload):
+        if only is not None and not name.startswith(only):
+            continue
+        results[name] = measure(func, repeat, setup)
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'stages': results,
+    }
+
+
+def regressions(results, baseline, threshold):
+    """Returns list of (stage, baseline, current) for stages which best time is slower than
+       baseline best time multiplied by threshold"""
+    slow = []
+    for name, timing in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is not None and timing['min'] > base['min'] * threshold:
+            slow.append((name, base['min'], timing['min']))
+    return slow
+
+
+def print_results(results):
+    for name, timing in results['stages'].items():
+        print(f"{name:36} min {timing['min']*1000:9.3f} ms   median {timing['median']*1000:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark paperclock rendering pipeline')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write results to JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='allowed slowdown relative to baseline, 1.25 = 25%% slower')
+    parser.add_argument('--only', help='run only stages starting with prefix')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = run(args.repeat, args.only)
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slow = regressions(results, baseline, args.threshold)
+        for name, base, current in slow:
+            print(
+                f'REGRESSION {name}: {base*1000:.3f} ms -> {current*1000:.3f} ms')
+        if slow:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
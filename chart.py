@@ -0,0 +1,104 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Charts rasterized into 1-bit masks with NumPy. Series are anything NumPy can view
+# as an array, e.g. array('d') columns of HourlySeries. Masks are ready for
+# Display.draw_mask(). NumPy is imported on the first chart, it takes long to import on Pi Zero
+
+from PIL import Image
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling to threshold points, keeps the shape of the series"""
+    import numpy as np
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def to_image(mask) -> Image:
+    return Image.fromarray(mask)
+
+
+def bars(values, height, step, gap=0, vmax=1.0) -> Image:
+    """Bar per value, step pixels apart and step - gap pixels wide. Bars grow from the bottom
+       row (height) up to height - value * height / vmax, so the mask is height + 1 rows high"""
+    import numpy as np
+    values = np.asarray(values, dtype=float)
+    tops = (height - values * (height / vmax)).astype(int)
+    columns = np.arange(len(values) * step)
+    in_bar = columns % step < step - gap
+    rows = np.arange(height + 1)[:, None]
+    return to_image(in_bar[None, :] & (rows >= tops[columns // step][None, :]))
+
+
+def line(values, width, height, low=None, high=None) -> Image:
+    """Line through the values stretched to the width. Values are scaled so that low is
+       the bottom and high is the top row, series range by default. Series longer than
+       width are downsampled with LTTB"""
+    import numpy as np
+    values = np.asarray(values, dtype=float)
+    if len(values) > width:
+        _, values = lttb(np.arange(len(values)), values, width)
+    low = values.min() if low is None else low
+    high = values.max() if high is None else high
+    if high > low:
+        rows = (height - 1) * (1 - (values - low) / (high - low))
+    else:
+        rows = np.full(len(values), (height - 1) / 2)
+    rows = np.clip(rows, 0, height - 1)
+    if len(rows) > 1:
+        rows = np.interp(np.arange(width), np.linspace(0, width - 1, len(rows)), rows)
+    else:
+        rows = np.full(width, rows[0] if len(rows) else height - 1)
+    rows = np.rint(rows).astype(int)
+    # every column covers the span to the next one, so steep segments stay connected
+    following = np.append(rows[1:], rows[-1])
+    top = np.minimum(rows, following)
+    bottom = np.maximum(rows, following)
+    y = np.arange(height)[:, None]
+    return to_image((y >= top[None, :]) & (y <= bottom[None, :]))
+
+
+def sparkline(values, width, height) -> Image:
+    """Line scaled to the series range with the last value marked"""
+    import numpy as np
+    mask = np.array(line(values, width, height), dtype=bool)
+    last = np.nonzero(mask[:, -1])[0]
+    if len(last):
+        row = last[0]
+        mask[max(0, row - 1):row + 2, max(0, width - 3):] = True
+    return to_image(mask)
@@ -0,0 +1,147 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import math
+import struct
+
+from PIL import Image, ImageDraw
+
+HOUR_POSITIONS = 12 * 60
+MINUTE_POSITIONS = 60
+
+_MAGIC = b'PCCF'
+_VERSION = 1
+_header = struct.Struct('<4sHH')
+_sprite = struct.Struct('<BBBB')
+
+
+class Sprite:
+    """1-bit mask cropped to its bounding box, offset is relative to the clock face origin"""
+    __slots__ = ('offset', 'mask')
+
+    def __init__(self, offset, mask):
+        self.offset = offset
+        self.mask = mask
+
+
+class ClockSprites:
+    """Pre-rendered analog clock face and hands for the clock of the given size.
+
+       Hands are rendered on first use. If path is given, all sprites are loaded from
+       the file or rendered and saved to it"""
+
+    def __init__(self, size, path=None):
+        self.size = size
+        self.face = self._render_face()
+        self.hour_hands = [None] * HOUR_POSITIONS
+        self.minute_hands = [None] * MINUTE_POSITIONS
+
+        if path is not None:
+            try:
+                self.load(path)
+            except Exception as ex:
+                print(f'Rendering clock sprites: {ex}')
+                try:
+                    self.save(path)
+                except OSError as ex:
+                    print(f'Failed to save clock sprites: {ex}')
+
+    def hour_hand(self, hour, minute):
+        index = (hour % 12) * 60 + minute
+        if self.hour_hands[index] is None:
+            angle = (hour % 12 + minute / 60.0) * 30.0 - 90
+            self.hour_hands[index] = self._render_hand(angle, 0.6, 3)
+        return self.hour_hands[index]
+
+    def minute_hand(self, minute):
+        if self.minute_hands[minute] is None:
+            angle = minute * 6 - 90
+            self.minute_hands[minute] = self._render_hand(angle, 0.9, 2)
+        return self.minute_hands[minute]
+
+    def evict(self):
+        """Releases hands, they are rendered again on the next use"""
+        self.hour_hands = [None] * HOUR_POSITIONS
+        self.minute_hands = [None] * MINUTE_POSITIONS
+
+    def render_all(self):
+        for index in range(HOUR_POSITIONS):
+            self.hour_hand(index // 60, index % 60)
+        for minute in range(MINUTE_POSITIONS):
+            self.minute_hand(minute)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, size = _header.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION or size != self.size:
+            raise ValueError(f'{path} is not a clock sprite file for size {self.size}')
+        offset = _header.size
+        sprites = []
+        for _ in range(HOUR_POSITIONS + MINUTE_POSITIONS):
+            x, y, w, h = _sprite.unpack_from(data, offset)
+            offset += _sprite.size
+            length = (w + 7) // 8 * h
+            mask = Image.frombytes('1', (w, h), data[offset:offset + length])
+            offset += length
+            sprites.append(Sprite((x, y), mask))
+        self.hour_hands = sprites[:HOUR_POSITIONS]
+        self.minute_hands = sprites[HOUR_POSITIONS:]
+
+    def save(self, path):
+        self.render_all()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_header.pack(_MAGIC, _VERSION, self.size))
+            for sprite in self.hour_hands + self.minute_hands:
+                f.write(_sprite.pack(*sprite.offset, *sprite.mask.size))
+                f.write(sprite.mask.tobytes())
+        os.replace(tmp, path)
+
+    def _new_mask(self):
+        return Image.new('1', (self.size + 1, self.size + 1), 0)
+
+    def _render_face(self):
+        """Returns (area, outline) masks. Area is cleared and outline is drawn on top of it"""
+        area = self._new_mask()
+        ImageDraw.Draw(area).ellipse(
+            [(0, 0), (self.size, self.size)], fill=1, outline=1, width=2)
+        outline = self._new_mask()
+        ImageDraw.Draw(outline).ellipse(
+            [(0, 0), (self.size, self.size)], fill=None, outline=1, width=2)
+        return (Sprite((0, 0), area), Sprite((0, 0), outline))
+
+    def _render_hand(self, angle, length, width):
+        radius = self.size / 2
+        x = radius * length * math.cos(math.radians(angle)) + radius
+        y = radius * length * math.sin(math.radians(angle)) + radius
+        mask = self._new_mask()
+        ImageDraw.Draw(mask).line(
+            [(radius, radius), (x, y)], fill=1, width=width)
+        bbox = mask.getbbox()
+        return Sprite(bbox[:2], mask.crop(bbox))
+
+
+def sprites_path(cache_dir, size):
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, f'clock-{size}.bin')
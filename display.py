@@ -19,20 +19,20 @@
 # SOFTWARE.
 
 import math
+import hashlib
 import datetime
-from pytz import timezone
-from dateutil.tz import tzlocal
-from threading import Timer
+import metrics
+import timesource
 
-from astral import Observer
-from PIL import Image, ImageDraw
-from astral.sun import sun
+from PIL import Image, ImageChops, ImageDraw
 
 from settings import Settings
 from resources import Resources
 from openweathermap import WeatherInfo, wind_direction_to_compass
-
-import waveshare_epd.epd2in7b as epd
+from panels import create_panel
+from textcache import TextCache
+from clockface import ClockSprites
+import chart
 
 
 DEBUG_CENTER_BOUNDS = False
@@ -43,18 +43,29 @@ class Display:
     BLACK = 0
     RED = 1
 
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, text_cache: TextCache = None):
         self.settings = settings
-        self.eInk = epd.EPD()
+        self.eInk = create_panel(settings.display)
 
-        self.settings = settings
         self.digital = self.settings.mode == 'digital'
 
         # horizontal display, so switch width and height
         self.screen_size = (self.eInk.height, self.eInk.width)
 
+        # minimal time between starts of two refreshes
+        self.refresh_guard = datetime.timedelta(seconds=25)
         self.last_refresh_start = datetime.datetime.fromtimestamp(0)
         self.buffers = []
+        self.text_cache = text_cache if text_cache is not None else TextCache()
+        # two sets of buffers: one holds the frame on the display, the other one is drawn into
+        self.buffer_pairs = []
+
+        # last frame pushed to the panel, one image and hash per color plane
+        self.last_frame = (None, None)
+        self.last_hashes = (None, None)
+        self.dirty_regions = (None, None)
+        # called with plane hashes after a frame is pushed to the panel
+        self.on_show = None
 
     def width(self):
         return self.screen_size[0]
@@ -62,21 +73,30 @@ class Display:
     def height(self):
         return self.screen_size[1]
 
+    def textsize(self, text, font):
+        return self.text_cache.textsize(text, font)
+
+    def draw_mask(self, xy, mask, buffer_id, fill=0):
+        """Fills pixels set in mask with the color"""
+        self.buffers[buffer_id + 2].paste(
+            fill, (int(xy[0]), int(xy[1])), mask)
+
     def draw_text(self, xy, text, font, buffer_id):
-        self.buffers[buffer_id].text(
-            xy, text, font=font, fill=0)
+        # placed the way ImageDraw.text does: integer part is the origin, fraction is rasterized
+        x, y = xy
+        start = (math.modf(x)[0], math.modf(y)[0])
+        self.draw_mask((int(x), int(y)), self.text_cache.bitmap(
+            text, font, start), buffer_id)
 
     def draw_text_centered(self, xy, w, text, font, buffer_id):
         """xy - top left coordinates of the bounding box
           w - width of the bounding box
 
           Text will be horizontally centered in the bounding box"""
-        tsize = self.buffers[buffer_id].textsize(
-            text, font=font)
+        tsize = self.textsize(text, font)
         x = (w - tsize[0]) / 2
 
-        self.buffers[buffer_id].text(
-            (xy[0] + x, xy[1]), text, font=font, fill=0)
+        self.draw_text((xy[0] + x, xy[1]), text, font, buffer_id)
 
         if DEBUG_CENTER_BOUNDS:
             self.buffers[buffer_id].line([xy, (xy[0], xy[1] + tsize[1])])
@@ -92,8 +112,7 @@ class Display:
 
     def draw_icon_text_centered(self, pos, width, image, text, font, image_buffer_id, text_buffer_id):
         # 2px between image and text
-        total_w = image.width + \
-            self.buffers[text_buffer_id].textsize(text, font=font)[0] + 2
+        total_w = image.width + self.textsize(text, font)[0] + 2
         left = pos[0] + (width - total_w) // 2
         self.draw_image((left, pos[1]), image, image_buffer_id)
         self.draw_text(
@@ -115,27 +134,86 @@ class Display:
         self.buffers[color].ellipse([tl, br], fill, outline, width)
 
     def new_screen(self):
-        """Initialize buffers for the new frame"""
-        blackimage = Image.new('1', self.screen_size, 255)
-        redimage = Image.new('1', self.screen_size, 255)
-        drawblack = ImageDraw.Draw(blackimage)
-        drawred = ImageDraw.Draw(redimage)
-
-        self.buffers = (drawblack, drawred, blackimage, redimage)
+        """Initialize buffers for the new frame. Buffers holding the frame shown on the display are not reused"""
+        for buffers in self.buffer_pairs:
+            if buffers[2] is not self.last_frame[0]:
+                buffers[2].paste(255, (0, 0) + self.screen_size)
+                buffers[3].paste(255, (0, 0) + self.screen_size)
+                break
+        else:
+            blackimage = Image.new('1', self.screen_size, 255)
+            redimage = Image.new('1', self.screen_size, 255)
+            drawblack = ImageDraw.Draw(blackimage)
+            drawred = ImageDraw.Draw(redimage)
+            buffers = (drawblack, drawred, blackimage, redimage)
+            self.buffer_pairs.append(buffers)
+
+        self.buffers = buffers
         return self.buffers
 
-    def show(self):
-        """Draw the screen and show it on the e-ink display"""
-        now = datetime.datetime.now()
-        if (now - self.last_refresh_start) > datetime.timedelta(seconds=25):
+    def refresh_delay(self):
+        """Returns number of seconds until display accepts the next refresh"""
+        elapsed = timesource.now() - self.last_refresh_start
+        return max(0.0, (self.refresh_guard - elapsed).total_seconds())
+
+    def frame_changes(self, buffers=None):
+        """Compares buffers with the last frame pushed to the panel.
+
+           Returns tuple of plane hashes and tuple of bounding boxes of changed pixels
+           for each color plane. Bounding box is None if the plane didn't change"""
+        buffers = buffers if buffers is not None else self.buffers
+        frame = (buffers[2], buffers[3])
+        hashes = tuple(hashlib.sha1(image.tobytes()).digest()
+                       for image in frame)
+        regions = []
+        for plane, image in enumerate(frame):
+            last = self.last_frame[plane]
+            if hashes[plane] == self.last_hashes[plane]:
+                regions.append(None)
+            elif last is None:
+                regions.append((0, 0) + self.screen_size)
+            else:
+                regions.append(ImageChops.logical_xor(last, image).getbbox())
+        return hashes, tuple(regions)
+
+    def show(self, buffers=None):
+        """Draw the screen and show it on the e-ink display. By default current buffers are shown,
+           buffers returned by new_screen() earlier can be passed to show previously drawn frame
+
+           Refresh is skipped if the frame is identical to the one already on the display"""
+        buffers = buffers if buffers is not None else self.buffers
+        hashes, regions = self.frame_changes(buffers)
+        if hashes == self.last_hashes:
+            print("frame is unchanged, skipping refresh")
+            metrics.FRAMES.inc(outcome='unchanged')
+            return False
+        now = timesource.now()
+        if (now - self.last_refresh_start) > self.refresh_guard:
             self.last_refresh_start = now
-            self.eInk.init()
-            self.eInk.display(self.eInk.getbuffer(
-                self.buffers[2]), self.eInk.getbuffer(self.buffers[3]))
-            self.eInk.sleep()
+            self.dirty_regions = regions
+            with metrics.timed(metrics.PANEL_SECONDS, op='init'):
+                self.eInk.init()
+            with metrics.timed(metrics.GETBUFFER_SECONDS, plane='black'):
+                black = self.eInk.getbuffer(buffers[2], self.BLACK)
+            with metrics.timed(metrics.GETBUFFER_SECONDS, plane='red'):
+                red = self.eInk.getbuffer(buffers[3], self.RED)
+            display_partial = getattr(self.eInk, 'display_partial', None)
+            with metrics.timed(metrics.PANEL_SECONDS, op='display'):
+                if display_partial is not None:
+                    display_partial(black, red, regions)
+                else:
+                    self.eInk.display(black, red)
+            with metrics.timed(metrics.PANEL_SECONDS, op='sleep'):
+                self.eInk.sleep()
+            self.last_frame = (buffers[2], buffers[3])
+            self.last_hashes = hashes
+            metrics.FRAMES.inc(outcome='shown')
+            if self.on_show is not None:
+                self.on_show(hashes)
             return True
         else:
             print("display is refreshing, ignoring refresh")
+            metrics.FRAMES.inc(outcome='guard')
             return False
 
 
@@ -143,52 +221,44 @@ class Weather:
     DEFAULT = 0
     CURRENT_DETAILS = 1
 
+    # One Call sections used for drawing, minutely precipitation is charted in the details view
+    SECTIONS = ('current', 'minutely', 'hourly')
+
     def __init__(self, display: Display, resources: Resources):
         self.display = display
         self.weather_info = None
+        # WeatherHistory of observations at this location, None if not kept
+        self.history = None
         self.res = resources
         self.state = self.DEFAULT
-        self.state_timer = None
 
     def update(self, weather_info: WeatherInfo):
         self.weather_info = weather_info
 
     def set_state(self, new_state):
         print(f'state change, current: {self.state}, new: {new_state}')
-        if self.state == new_state:
-            return
-        if self.state_timer is not None:
-            self.state_timer.cancel()
-            self.state_time = None
         self.state = new_state
-        if self.state != self.DEFAULT:
-            print('setting timer to 25 seconds')
-            self.state_timer = Timer(
-                25, lambda: self.set_state(self.DEFAULT)).start()
 
     def draw_hourly_pop(self, pos, width, height):
         if self.weather_info is None:
             return
-        hourly_pop = [
-            m.pop*100 for m in self.weather_info.hourly][0:8]
-        scale_y = height / 100.0  # max pop is always 100%
+        hourly_pop = [pop * 100 for pop in self.weather_info.hourly.pop[0:8]]
+        if len(hourly_pop) == 0:
+            return
         scale_x = math.trunc(width / len(hourly_pop))
 
-        bottom = pos[1] + height
-        x = 0
-        for m in hourly_pop:
-            self.display.rect((pos[0] + x, int(bottom - m*scale_y)), (pos[0] +
-                                                                      x + scale_x - 5, bottom), self.display.BLACK, fill=0, outline=0)
-            x += scale_x
+        # max pop is always 100%
+        self.display.draw_mask(pos, chart.bars(
+            hourly_pop, height, scale_x, gap=4, vmax=100), self.display.BLACK)
+        x = scale_x * len(hourly_pop)
         self.display.line((pos[0], pos[1]), (x, pos[1]), self.display.RED)
 
     def draw_wind(self, pos, width):
-        if self.weather_info is None:
+        if self.weather_info is None or self.weather_info.current is None:
             return
         current = self.weather_info.current
         speed = round(current.wind_speed * 3.6, 1)  # m/s -> km/h
-        wind = self.res.icon('weather/wind')
-        wind = wind.rotate(current.wind_direction, fillcolor=1)
+        wind = self.res.wind_icon(current.wind_direction)
 
         icon_offset_x = (width - wind.width) // 2
 
@@ -201,7 +271,7 @@ class Weather:
 
     def draw_current_weather(self):
         pos = (5, 99)
-        if self.weather_info is not None:
+        if self.weather_info is not None and self.weather_info.current is not None:
             icon = self.res.icon(
                 f'weather/{self.weather_info.current.weather[0].icon}')
             self.display.draw_image(pos, icon, self.display.RED)
@@ -227,7 +297,7 @@ class Weather:
             self.draw_current_details()
 
     def draw_current_details(self):
-        if self.weather_info is not None:
+        if self.weather_info is not None and self.weather_info.current is not None:
             icon = self.res.icon(
                 f'weather/{self.weather_info.current.weather[0].icon}')
             self.display.draw_image_centered(
@@ -251,6 +321,28 @@ class Weather:
                                    self.res.med_font, self.display.BLACK)
             self.display.draw_text((3, 120), f'UV Index: {self.weather_info.current.uvi}',
                                    self.res.med_font, self.display.BLACK)
+            self.draw_detail_charts(150)
+
+    def draw_detail_charts(self, top):
+        """Temperature forecast for the next day on the left, minutely precipitation
+           (if any is expected) or observed temperature for the last day on the right"""
+        half = self.display.width() // 2
+        height = self.display.height() - top - 2
+        hourly = self.weather_info.hourly
+        if len(hourly) > 1:
+            self.display.draw_mask((3, top), chart.line(
+                hourly.temperature[0:24], half - 6, height), self.display.BLACK)
+
+        minutely = self.weather_info.minutely_precipitation
+        if len(minutely) > 0 and max(minutely.precipitation) > 0:
+            step = max(1, (half - 6) // len(minutely))
+            self.display.draw_mask((half + 3, top), chart.bars(
+                minutely.precipitation, height - 1, step, vmax=max(minutely.precipitation)), self.display.RED)
+        elif self.history is not None and len(self.history) > 1:
+            day = self.history.window(self.history[-1].time - 24 * 3600)
+            if len(day) > 1:
+                self.display.draw_mask((half + 3, top), chart.sparkline(
+                    [o.temperature for o in day], half - 6, height), self.display.RED)
 
 
 class Clock:
@@ -261,14 +353,18 @@ class Clock:
         self.display = display
         self.settings = settings
         self.res = resources
+        self.sprites = resources.clock_sprites(
+            self.CLOCK_FACE, settings.cache_dir)
+        self.astronomy = resources.astronomy(
+            settings.position, [settings.secondTZ], settings.cache_dir)
 
-    def draw_current_time_other_tz(self, pos, width, font=None, vertical=True):
+    def draw_current_time_other_tz(self, pos, width, font=None, vertical=True, now=None):
         if font is None:
             font = self.res.small_font
-        dh = font.getsize("Wy")[1]
+        dh = self.display.textsize("Wy", font)[1]
         if self.settings.secondTZ is not None:
-            tz = timezone(self.settings.secondTZ)
-            now = datetime.datetime.now(tz)
+            ts = now.timestamp() if now is not None else None
+            now = self.astronomy.now(self.settings.secondTZ, ts)
             time = now.strftime(self.settings.time_format)
             date = now.strftime(self.settings.date_format)
             black = self.display.BLACK
@@ -285,23 +381,22 @@ class Clock:
                 self.display.draw_text_centered(
                     (pos[0], pos[1] + dh), width, date, font, black)
 
-    def draw_sun(self, pos, width):
-        observer = Observer(
-            latitude=self.settings.position['lat'],
-            longitude=self.settings.position['lon'])
-
-        tz = tzlocal()
-        s = sun(observer, tzinfo=tz)
-        rise_time = s['sunrise'].strftime(self.settings.time_format)
-        set_time = s['sunset'].strftime(self.settings.time_format)
+    def draw_sun(self, pos, width, now=None):
+        now = now if now is not None else timesource.now()
+        sunrise, sunset = self.astronomy.sun(now.date())
+        no_time = '--:--'
+        rise_time = sunrise.strftime(
+            self.settings.time_format) if sunrise is not None else no_time
+        set_time = sunset.strftime(
+            self.settings.time_format) if sunset is not None else no_time
 
         self.display.draw_icon_text_centered(pos, width // 2, self.res.sunrise, rise_time,
                                              self.res.tiny_font, self.display.RED, self.display.BLACK)
         self.display.draw_icon_text_centered((pos[0] + width // 2, pos[1]), width // 2, self.res.sunrise,
                                              set_time, self.res.tiny_font, self.display.RED, self.display.BLACK)
 
-    def draw_current_date(self, pos, width):
-        now = datetime.datetime.now()
+    def draw_current_date(self, pos, width, now=None):
+        now = now if now is not None else timesource.now()
         date = now.strftime(self.settings.date_format)
         if width is None:
             self.display.draw_text(pos, date, self.res.med_font,
@@ -310,50 +405,42 @@ class Clock:
             self.display.draw_text_centered(pos, width, date,
                                             self.res.med_font, self.display.BLACK)
 
-    def draw_analog_time(self, pos, width):
-        radius = width / 2
-        center = (pos[0] + radius, pos[1] + radius)
-        br = (pos[0] + width, pos[1] + width)  # bottom right corner
+    def _draw_sprite(self, pos, sprite, fill=0):
+        self.display.draw_mask((pos[0] + sprite.offset[0], pos[1] + sprite.offset[1]),
+                               sprite.mask, self.display.BLACK, fill=fill)
 
-        now = datetime.datetime.now()
-        hr_angle = (now.hour % 12 + now.minute / 60.0) * 30.0 - 90
-        min_angle = now.minute * 6 - 90
-
-        hr_x = radius*0.6 * \
-            math.cos(math.radians(hr_angle)) + pos[0] + radius
-        hr_y = radius*0.6 * \
-            math.sin(math.radians(hr_angle)) + pos[1] + radius
-
-        min_x = radius * 0.9 * \
-            math.cos(math.radians(min_angle)) + pos[0] + radius
-        min_y = radius * 0.9 * \
-            math.sin(math.radians(min_angle)) + pos[1] + radius
+    def draw_analog_time(self, pos, width, now=None):
+        now = now if now is not None else timesource.now()
+        if width != self.sprites.size:
+            self.sprites = ClockSprites(width)
 
         # clock face
-        self.display.ellipse(pos, br, self.display.BLACK,
-                             fill=1, outline=0, width=2)
+        area, outline = self.sprites.face
+        self._draw_sprite(pos, area, fill=1)
+        self._draw_sprite(pos, outline)
         # hour hand
-        self.display.line(center, (hr_x, hr_y),
-                          self.display.BLACK, fill=0, width=3)
+        self._draw_sprite(pos, self.sprites.hour_hand(now.hour, now.minute))
         # minute hand
-        self.display.line(center, (min_x, min_y),
-                          self.display.BLACK, fill=0, width=2)
+        self._draw_sprite(pos, self.sprites.minute_hand(now.minute))
         # digital time
         self.display.draw_text_centered((pos[0], pos[1] + width - 25), width, now.strftime(self.settings.time_format),
                                         self.res.tiny_font, self.display.RED)
 
-    def draw_time_data(self):
-        """Draws time-related information: current time/date, second TZ time/date, sunrise, sunset times"""
+    def draw_time_data(self, now=None):
+        """Draws time-related information for the given local time, current time by default:
+           current time/date, second TZ time/date, sunrise, sunset times"""
 
+        now = now if now is not None else timesource.now()
         clock_bound = self.OFFSET + self.CLOCK_FACE
 
         self.draw_analog_time(
-            (self.OFFSET, self.OFFSET), self.CLOCK_FACE)
+            (self.OFFSET, self.OFFSET), self.CLOCK_FACE, now)
         self.draw_current_date(
-            (clock_bound, 0), self.display.width() - clock_bound)
-        self.draw_sun((clock_bound, 30), self.display.width() - clock_bound)
+            (clock_bound, 0), self.display.width() - clock_bound, now)
+        self.draw_sun((clock_bound, 30),
+                      self.display.width() - clock_bound, now)
         self.draw_current_time_other_tz(
-            (clock_bound, 50), self.display.width() - clock_bound, font=self.res.tiny_font, vertical=False)
+            (clock_bound, 50), self.display.width() - clock_bound, font=self.res.tiny_font, vertical=False, now=now)
 
 
 class Layout:
@@ -361,20 +448,33 @@ class Layout:
        Layout is also responsible for drawing borders
     """
 
-    def __init__(self, display: Display, settings: Settings) -> None:
+    def __init__(self, display: Display, settings: Settings, resources: Resources = None) -> None:
         self.display = display
         self.settings = settings
-        self.resources = Resources()
+        self.resources = resources if resources is not None else Resources()
         self.weather = Weather(display, self.resources)
         self.clock = Clock(self.display, self.resources, settings)
-
-    def draw(self):
-        self.display.new_screen()
-        self._draw_frame()
-        if (self.weather.state == self.weather.DEFAULT):
-            self.clock.draw_time_data()
-        self.weather.draw_weather_data()
-        self.display.show()
+        # layouts sharing resources don't draw at the same time
+        self.lock = self.resources.lock
+
+    def state_key(self):
+        """Frame drawn for the given time stays valid while state key is the same"""
+        return (id(self.weather.weather_info), self.weather.state)
+
+    def render(self, now=None):
+        """Draws the frame for the given local time into display buffers and returns the buffers"""
+        with self.lock, metrics.timed(metrics.RENDER_SECONDS):
+            buffers = self.display.new_screen()
+            self._draw_frame()
+            if (self.weather.state == self.weather.DEFAULT):
+                self.clock.draw_time_data(now)
+            self.weather.draw_weather_data()
+            return buffers
+
+    def draw(self, now=None):
+        buffers = self.render(now)
+        # panel refresh doesn't use shared resources, other layouts can draw meanwhile
+        self.display.show(buffers)
 
     def _draw_frame(self):
         if (self.weather.state == self.weather.DEFAULT):
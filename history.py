@@ -0,0 +1,132 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# History of observed weather in a fixed size memory mapped ring buffer. File layout:
+#
+#    header: magic, version, capacity, number of records ever appended
+#    capacity fixed width records: time, temperature, pressure, humidity,
+#    wind speed, wind direction, probability of precipitation
+#
+# Records are appended in time order, oldest record is overwritten when the buffer is full.
+
+import os
+import mmap
+import struct
+from collections import namedtuple
+
+_MAGIC = b'PCWH'
+_VERSION = 1
+_header = struct.Struct('<4sHxxIQ')
+_record = struct.Struct('<qffffff')
+
+Observation = namedtuple('Observation', ['time', 'temperature', 'pressure', 'humidity',
+                                         'wind_speed', 'wind_direction', 'pop'])
+
+
+class WeatherHistory:
+    """Ring buffer of observations stored in the file. Appends are O(1), windows are found
+       by binary search and only the records in the window are read"""
+
+    def __init__(self, path, capacity=4 * 24 * 30):
+        self.path = path
+        self.capacity = capacity
+        size = _header.size + capacity * _record.size
+        exists = os.path.isfile(path) and os.path.getsize(path) == size
+        with open(path, 'r+b' if exists else 'w+b') as f:
+            if not exists:
+                f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size)
+        magic, version, capacity, self.total = _header.unpack_from(self.map, 0)
+        if (magic, version, capacity) != (_MAGIC, _VERSION, self.capacity):
+            if magic == _MAGIC:
+                print(f'Weather history {path} has different format, starting new one')
+            self.total = 0
+            self._write_header()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, observation: Observation):
+        """Appends the observation. Observations not newer than the last one are ignored"""
+        if len(self) > 0 and observation.time <= self._time(len(self) - 1):
+            return False
+        _record.pack_into(self.map, self._offset(self.total % self.capacity), *observation)
+        self.total += 1
+        self._write_header()
+        self.map.flush()
+        return True
+
+    def append_weather(self, weather_info):
+        """Appends current conditions of the WeatherInfo, returns False if it has none"""
+        current = weather_info.current
+        if current is None:
+            return False
+        hourly = weather_info.hourly
+        pop = hourly.pop[0] if len(hourly) > 0 else 0.0
+        return self.append(Observation(current.dt, current.temperature, current.pressure, current.humidity,
+                                       current.wind_speed, current.wind_direction, pop))
+
+    def __getitem__(self, index) -> Observation:
+        """Observation by index, 0 is the oldest one"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Observation._make(_record.unpack_from(self.map, self._offset(self._physical(index))))
+
+    def last(self, count=1):
+        """Up to count latest observations, oldest first"""
+        return [self[i] for i in range(max(0, len(self) - count), len(self))]
+
+    def window(self, start, end=None):
+        """Observations with start <= time < end, oldest first"""
+        first = self._bisect(start)
+        last = self._bisect(end) if end is not None else len(self)
+        return [self[i] for i in range(first, last)]
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+    def _bisect(self, ts):
+        """Index of the first observation with time >= ts"""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < ts:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _physical(self, index):
+        return (self.total - len(self) + index) % self.capacity
+
+    def _offset(self, physical):
+        return _header.size + physical * _record.size
+
+    def _time(self, index):
+        return struct.unpack_from('<q', self.map, self._offset(self._physical(index)))[0]
+
+    def _write_header(self):
+        _header.pack_into(self.map, 0, _MAGIC, _VERSION, self.capacity, self.total)
@@ -0,0 +1,105 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import random
+import datetime
+from email.utils import parsedate_to_datetime
+
+import timesource
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def retry_after(response):
+    """Returns delay in seconds requested by Retry-After header or None"""
+    value = response.headers.get('Retry-After', None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class HttpClient:
+    """HTTP client keeping connections alive between requests.
+
+       Every request has connect and read timeouts. Connection errors, timeouts and
+       429/5xx responses are retried with jittered exponential backoff, Retry-After
+       header is honored"""
+
+    def __init__(self, connect_timeout=5, read_timeout=20, retries=3, backoff=2.0, max_backoff=120):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._session = None
+
+    @property
+    def session(self):
+        # requests takes long to import on Pi Zero, so it is imported on the first request
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip'
+            self._session = session
+        return self._session
+
+    def get(self, url, params=None, headers=None):
+        import requests
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                if attempt >= self.retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f'Request failed: {ex}, retrying in {delay:.1f}s')
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                delay = min(delay, self.max_backoff)
+                print(
+                    f'Request failed: {response.status_code} {response.reason}, retrying in {delay:.1f}s')
+            timesource.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
@@ -1,13 +1,188 @@
+import heapq
+import itertools
 import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
+import metrics
+import timesource
 
-class repeating:
-    def __init__(self, interval_calculator):
-        self.interval = interval_calculator
+# Longest time scheduler sleeps without checking the clock, so that wall clock
+# changes (NTP sync after boot) are noticed
+MAX_WAIT = 60
 
-    def __call__(self, func):
-        def wrapped(*args):
-            func(*args)
-            sleep_for = self.interval()
-            threading.Timer(sleep_for, lambda: wrapped(*args)).start()
-        return wrapped
+
+class Job:
+    def __init__(self, func, args, interval, align, background, name, offset=0):
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.align = align
+        self.offset = offset
+        self.background = background
+        self.name = name or func.__name__
+        self.next_run = None
+        self.entry = None
+        self.running = False
+        self.cancelled = False
+        self.last_drift = 0.0
+
+    def get_interval(self):
+        return self.interval() if callable(self.interval) else self.interval
+
+    def __repr__(self):
+        return f'Job({self.name})'
+
+
+class Scheduler:
+    """Runs jobs on a single thread using a heap ordered by the next run time.
+
+       Jobs are either repeating with fixed or computed interval, optionally aligned to
+       the wall clock, or one-shot. Missed runs are coalesced into one, exceptions are logged
+       and don't stop the job. Background jobs (e.g. network requests) are run on a single
+       worker thread so they don't delay other jobs"""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition(threading.RLock())
+        self._running = False
+        self._worker = None
+        self._thread = None
+
+    def every(self, interval, func, *args, align=False, offset=0, run_now=False, background=False, name=None) -> Job:
+        """Runs func every interval seconds. interval can be a function returning number of seconds.
+
+           If align is set, runs happen when wall clock time is a multiple of interval shifted by offset,
+           e.g. every(60, func, align=True) runs at second 0 of every minute and
+           every(60, func, align=True, offset=-10) runs at second 50"""
+        job = Job(func, args, interval, align, background, name, offset)
+        with self._cond:
+            self._push(job, timesource.time() if run_now else self._next_time(job, timesource.time()))
+        return job
+
+    def call_later(self, delay, func, *args, background=False, name=None) -> Job:
+        job = Job(func, args, None, False, background, name)
+        with self._cond:
+            self._push(job, timesource.time() + delay)
+        return job
+
+    def trigger(self, job):
+        """Runs the job as soon as possible. Job that is already due is run only once"""
+        with self._cond:
+            now = timesource.time()
+            if job.cancelled or (job.entry is not None and job.next_run <= now):
+                return
+            self._push(job, now)
+
+    def reschedule(self, job):
+        """Recomputes the next run time of a repeating job, e.g. after its interval changed"""
+        with self._cond:
+            if not job.cancelled and not job.running and job.interval is not None:
+                self._push(job, self._next_time(job, timesource.time()))
+
+    def cancel(self, job):
+        with self._cond:
+            job.cancelled = True
+            job.entry = None
+            self._cond.notify()
+
+    def start(self):
+        """Runs scheduler loop on a separate thread"""
+        self._thread = threading.Thread(
+            target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Runs scheduler loop on the current thread until shutdown() is called"""
+        with self._cond:
+            self._running = True
+            while self._running:
+                job = self._pop_due()
+                if job is not None:
+                    self._dispatch(job)
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._worker is not None:
+            self._worker.shutdown(wait=wait)
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _next_time(self, job, now):
+        interval = job.get_interval()
+        if job.align:
+            return ((now - job.offset) // interval + 1) * interval + job.offset
+        return now + interval
+
+    def _push(self, job, when):
+        job.next_run = when
+        job.entry = next(self._seq)
+        heapq.heappush(self._heap, (when, job.entry, job))
+        self._cond.notify()
+
+    def _pop_due(self):
+        """Waits until the first job is due and returns it, returns None if woken up earlier"""
+        while self._heap:
+            when, entry, job = self._heap[0]
+            if job.entry != entry or job.cancelled:
+                heapq.heappop(self._heap)  # stale entry
+                continue
+            delay = when - timesource.time()
+            if delay > 0:
+                timesource.wait(self._cond, min(delay, MAX_WAIT))
+                return None
+            heapq.heappop(self._heap)
+            job.entry = None
+            job.last_drift = -delay
+            metrics.SCHEDULER_DRIFT_SECONDS.observe(-delay, job=job.name)
+            return job
+        timesource.wait(self._cond, MAX_WAIT)
+        return None
+
+    def _dispatch(self, job):
+        if job.running:
+            # previous run is still in progress, coalesce
+            self._reschedule_after_run(job)
+            return
+        job.running = True
+        if job.background:
+            if self._worker is None:
+                self._worker = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='scheduler-worker')
+            self._worker.submit(self._execute, job)
+        else:
+            self._cond.release()
+            try:
+                self._execute(job)
+            finally:
+                self._cond.acquire()
+
+    def _execute(self, job):
+        try:
+            job.func(*job.args)
+        except Exception:
+            print(f'Job {job.name} failed')
+            traceback.print_exc()
+        finally:
+            with self._cond:
+                job.running = False
+                self._reschedule_after_run(job)
+
+    def _reschedule_after_run(self, job):
+        if job.cancelled or job.interval is None or job.entry is not None:
+            return
+        interval = job.get_interval()
+        when = job.next_run + interval
+        now = timesource.time()
+        if when <= now:
+            # missed one or more runs, coalesce them into the next one
+            when = self._next_time(job, now)
+        elif job.align:
+            # keep the job on the wall clock grid even if interval changed
+            when = ((when - job.offset) // interval) * interval + job.offset
+            if when <= job.next_run:
+                when += interval
+        self._push(job, when)
@@ -5,6 +5,11 @@
 #define ON_LENGTH (5*1000)
 #define DIMMING_LENGTH (5*1000)
 
+// Presence events for the clock: PRESENT when somebody comes close, ABSENT when nobody
+// was seen for ABSENT_AFTER. Current state is repeated every REPORT_INTERVAL
+#define ABSENT_AFTER (5L*60*1000)
+#define REPORT_INTERVAL (60L*1000)
+
 // Use two pins to drive two LEDs. Two leds on one pin are too close to 40 mA draw limit on atmega
 const int led1 = 3;
 const int led2 = 5;
@@ -24,13 +29,35 @@ int state = OFF;
 long on_start;
 int led_value;
 
+bool present = false;
+unsigned long last_seen;
+unsigned long last_report;
+
+void report_presence() {
+  Serial.println(present ? "PRESENT" : "ABSENT");
+  last_report = millis();
+}
+
 void loop() {
   int distance = analogRead(dist);
 
   if (distance > 475) {
     state = ON;
     on_start = millis();
+    last_seen = millis();
+    if (!present) {
+      present = true;
+      report_presence();
+    }
   } 
+  if (present && (millis() - last_seen) > ABSENT_AFTER) {
+    present = false;
+    report_presence();
+  }
+  if ((millis() - last_report) > REPORT_INTERVAL) {
+    report_presence();
+  }
+
   if (state == ON && (millis() - on_start) < ON_LENGTH) { // LEDs on
     led_value = 255;
     digitalWrite(led1, 1);
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Memory use of the clock: RSS, estimated memory held by every subsystem and
+# tracemalloc snapshots on demand. Run a soak check, which renders thousands of
+# frames and fails if RSS keeps growing:
+#
+#    ./memory.py --soak 5000 [--low-memory]
+
+import os
+import sys
+import gc
+import json
+import argparse
+import datetime
+import tracemalloc
+from array import array
+from collections import deque
+
+import metrics
+import timesource
+
+
+def rss():
+    """Resident set size in bytes, None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def image_bytes(image):
+    if image is None:
+        return 0
+    w, h = image.size
+    if image.mode == '1':
+        return (w + 7) // 8 * h
+    return w * h * len(image.getbands())
+
+
+def deep_size(obj, seen=None):
+    """Approximate size of the object graph in bytes"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, array, int, float)):
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    else:
+        if hasattr(obj, '__dict__'):
+            size += deep_size(vars(obj), seen)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def attribution(controller):
+    """Estimated bytes held by fonts, icons, text bitmaps, clock sprites, weather and frame buffers.
+
+       Fonts are estimated by the size of the font files"""
+    res = controller.resources
+    # caches are reordered by the drawing threads, they are iterated under the drawing lock
+    with res.lock:
+        loaded = vars(res)
+        usage = {}
+        usage['fonts'] = sum(os.path.getsize(path) for path in
+                             {res.fonts[name][0] for name in res.fonts if name in loaded})
+        usage['icons'] = sum(image_bytes(icon) for icon in res.icons.items.values()) + \
+            sum(image_bytes(loaded[name]) for name in res.images if name in loaded)
+        cache = res.text_cache
+        usage['text'] = sum(image_bytes(mask) for mask in cache.bitmaps.items.values()) + \
+            sum(image_bytes(glyph) for glyph, _ in cache.glyphs.items.values())
+        usage['sprites'] = 0
+        for sprites in res.sprites.values():
+            usage['sprites'] += image_bytes(sprites.face[0].mask) + \
+                image_bytes(sprites.face[1].mask)
+            usage['sprites'] += sum(image_bytes(sprite.mask) for sprite in sprites.hour_hands + sprites.minute_hands
+                                    if sprite is not None)
+        seen = set()
+        usage['weather'] = sum(deep_size(screen.layout.weather.weather_info, seen)
+                               for screen in controller.screens
+                               if screen.layout.weather.weather_info is not None)
+        usage['buffers'] = 0
+        for screen in controller.screens:
+            display = screen.display
+            usage['buffers'] += sum(image_bytes(buffers[2]) + image_bytes(buffers[3])
+                                    for buffers in display.buffer_pairs)
+            panel = vars(display.eInk)
+            usage['buffers'] += sum(len(b) for b in panel.get('buffers', None) or [])
+            usage['buffers'] += sum(len(black) + len(red)
+                                    for black, red in panel.get('frames', []))
+        return usage
+
+
+def snapshot(top=15):
+    """Top allocation sites by size. Tracing is started on the first call, so
+       allocations made before it are not seen"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        return ['tracemalloc started, allocations made from now on are reported by the next snapshot']
+    snap = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),))
+    return [str(stat) for stat in snap.statistics('lineno')[:top]]
+
+
+class MemoryMonitor:
+    """Samples RSS and subsystem usage, keeps the history and exports it as metrics"""
+
+    def __init__(self, controller, history=288):
+        self.controller = controller
+        self.history = deque(maxlen=history)
+
+    def sample(self):
+        usage = attribution(self.controller)
+        current = rss()
+        self.history.append((timesource.time(), current, usage))
+        if current is not None:
+            metrics.RSS_BYTES.set(current)
+        for subsystem, size in usage.items():
+            metrics.MEMORY_BYTES.set(size, subsystem=subsystem)
+        return usage
+
+    def dump(self, path):
+        """Writes current usage, RSS history and tracemalloc snapshot to the file"""
+        usage = self.sample()
+        with open(path, 'w') as f:
+            f.write(f'{timesource.now()}\n\nSubsystems:\n')
+            for subsystem, size in usage.items():
+                f.write(f'  {subsystem:10} {size / 1024:10.1f} KiB\n')
+            f.write('\nRSS:\n')
+            for at, value, _ in self.history:
+                if value is not None:
+                    f.write(
+                        f'  {datetime.datetime.fromtimestamp(at)} {value / 1024:10.0f} KiB\n')
+            f.write('\nAllocations:\n')
+            for line in snapshot():
+                f.write(f'  {line}\n')
+        print(f'Memory report written to {path}')
+
+
+def soak(frames, low_memory=False, max_growth=2 * 1024 * 1024):
+    """Renders frames for consecutive clock ticks with weather updates and detail screens
+       in between on the headless panel. Returns True if RSS after warm-up grew less than max_growth"""
+    from openweathermap import WeatherInfo
+    from settings import Settings
+    from paperclock import Controller
+
+    with open('data/onecall-sample.json') as f:
+        sample = json.load(f)
+    config = dict(Settings.default_config, low_memory=low_memory,
+                  display={'backend': 'headless'})
+    controller = Controller(Settings(config))
+    screen = controller.screens[0]
+    screen.display.refresh_guard = datetime.timedelta(0)
+    weather = screen.layout.weather
+    monitor = MemoryMonitor(controller)
+
+    start = datetime.datetime(2026, 1, 1)
+    warm_up = max(1, frames // 10)
+    baseline = None
+    for frame in range(frames):
+        if frame % 8 == 0:
+            data = json.loads(json.dumps(sample))
+            data['current']['temp'] = frame % 40 - 10
+            weather.update(WeatherInfo(data))
+            if low_memory:
+                weather.weather_info.release(weather.SECTIONS)
+        weather.state = weather.CURRENT_DETAILS if frame % 50 == 49 else weather.DEFAULT
+        screen.layout.draw(start + datetime.timedelta(minutes=2 * frame))
+        if low_memory and frame % 30 == 29:
+            controller.trim_memory()
+        if frame == warm_up:
+            gc.collect()
+            baseline = rss()
+        if frame % (frames // 10 or 1) == 0:
+            usage = monitor.sample()
+            current = monitor.history[-1][1]
+            print(f'frame {frame:6d}  rss {current / 1024:8.0f} KiB  ' +
+                  '  '.join(f'{k} {v / 1024:.0f}' for k, v in usage.items()))
+    gc.collect()
+    growth = rss() - baseline
+    print(f'RSS growth after warm-up: {growth / 1024:+.0f} KiB')
+    return growth < max_growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory soak check')
+    parser.add_argument('--soak', type=int, default=5000,
+                        help='number of frames to render')
+    parser.add_argument('--low-memory', action='store_true')
+    parser.add_argument('--max-growth', type=int, default=2048,
+                        help='allowed RSS growth after warm-up, KiB')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if rss() is None:
+        print('RSS is not available on this system')
+        return 2
+    ok = soak(args.soak, args.low_memory, args.max_growth * 1024)
+    print('OK' if ok else 'FAILED: RSS keeps growing')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
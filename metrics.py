@@ -0,0 +1,249 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Metrics recorded by the clock, exposed in Prometheus text format over HTTP and
+# flushed periodically to a JSON file:
+#
+#    RENDER_SECONDS.observe(seconds)
+#    with metrics.timed(PANEL_SECONDS, op='display'):
+#        ...
+#    FRAMES.inc(outcome='guard')
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# default buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in key + tuple(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_key(labels), 0)
+
+    def prometheus(self):
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(key), 'value': value} for key, value in sorted(self.values.items())]
+
+
+class Gauge:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def set(self, value, **labels):
+        self.values[_key(labels)] = value
+
+    def value(self, **labels):
+        return self.values.get(_key(labels), None)
+
+    def prometheus(self):
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+    def snapshot(self):
+        return [{'labels': dict(key), 'value': value} for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """Histogram with fixed buckets, one series per set of labels"""
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self.series.get(_key(labels))
+        return sum(series[:-1]) if series is not None else 0
+
+    def prometheus(self):
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self.series.items()):
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    total += count
+                    lines.append(
+                        f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {total}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {series[-1]}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {total}')
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(key),
+                     'buckets': dict(zip([str(b) for b in self.buckets + ('+Inf',)], series[:-1])),
+                     'sum': series[-1],
+                     'count': sum(series[:-1])} for key, series in sorted(self.series.items())]
+
+
+registry = {}
+
+
+def counter(name, help):
+    return registry.setdefault(name, Counter(name, help))
+
+
+def gauge(name, help):
+    return registry.setdefault(name, Gauge(name, help))
+
+
+def histogram(name, help, buckets=BUCKETS):
+    return registry.setdefault(name, Histogram(name, help, buckets))
+
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def prometheus():
+    lines = []
+    for metric in registry.values():
+        lines.extend(metric.prometheus())
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    return {'time': time.time(),
+            'metrics': {name: metric.snapshot() for name, metric in registry.items()}}
+
+
+def write_json(path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serves metrics in Prometheus text format on a background thread"""
+
+    def __init__(self, address='127.0.0.1', port=9101):
+        self.server = ThreadingHTTPServer((address, port), _Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+RENDER_SECONDS = histogram(
+    'paperclock_render_seconds', 'Time to draw a frame into the buffers')
+GETBUFFER_SECONDS = histogram(
+    'paperclock_getbuffer_seconds', 'Time to pack a color plane for the panel')
+PANEL_SECONDS = histogram(
+    'paperclock_panel_seconds', 'Duration of panel operations (init, display, sleep)')
+FRAMES = counter(
+    'paperclock_frames_total', 'Frames by outcome (shown, unchanged, guard)')
+BUTTON_LATENCY_SECONDS = histogram(
+    'paperclock_button_to_pixels_seconds', 'Time from a button press to the end of the panel refresh')
+WEATHER_SECONDS = histogram(
+    'paperclock_weather_request_seconds', 'OpenWeatherMap request latency')
+WEATHER_RESPONSES = counter(
+    'paperclock_weather_responses_total', 'OpenWeatherMap responses by status')
+WEATHER_BYTES = counter(
+    'paperclock_weather_bytes_total', 'Bytes received from OpenWeatherMap')
+SCHEDULER_DRIFT_SECONDS = histogram(
+    'paperclock_scheduler_drift_seconds', 'Delay between the planned and the actual job start',
+    (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+RSS_BYTES = gauge(
+    'paperclock_rss_bytes', 'Resident set size of the process')
+MEMORY_BYTES = gauge(
+    'paperclock_memory_bytes', 'Estimated memory held by subsystem')
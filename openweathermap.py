@@ -19,8 +19,14 @@
 # SOFTWARE.
 
 import math
-import requests
+import json
+import time
 import datetime
+import threading
+from array import array
+
+import metrics
+from httpclient import HttpClient
 
 
 def get_s(key, json, default=None):
@@ -39,7 +45,13 @@ class Position:
         self.lon = lon
 
 
+def _datetime(ts):
+    return datetime.datetime.fromtimestamp(ts) if ts is not None else None
+
+
 class Weather:
+    __slots__ = ('id', 'name', 'description', 'icon')
+
     def __init__(self, json) -> None:
         self.id = json['id']
         self.name = json['main']
@@ -47,17 +59,15 @@ class Weather:
         self.icon = json['icon']
 
 
-class MinutelyPrecipitation:
-    def __init__(self, json) -> None:
-        self.time = datetime.datetime.fromtimestamp(json['dt'])
-        self.precipitation = json['precipitation']
-
-
 class DailyForecast:
+    __slots__ = ('dt', 'sunrise_dt', 'sunset_dt', 'temperatures', 'feels_like', 'pressure', 'humidity',
+                 'dew_point', 'uvi', 'clouds', 'visibility', 'wind_speed', 'wind_direction', 'wind_gust',
+                 'weather', 'rain', 'pop')
+
     def __init__(self, json) -> None:
-        self.time = datetime.datetime.fromtimestamp(json['dt'])
-        self.sunrise = get_f('sunrise', json, datetime.datetime.fromtimestamp)
-        self.sunset = get_f('sunset', json, datetime.datetime.fromtimestamp)
+        self.dt = json['dt']
+        self.sunrise_dt = get_s('sunrise', json)
+        self.sunset_dt = get_s('sunset', json)
         self.temperatures = json['temp']
         self.feels_like = get_s('feels_like', json)
         self.pressure = json['pressure']
@@ -68,26 +78,52 @@ class DailyForecast:
         self.visibility = get_s('visibility', json)
         self.wind_speed = json['wind_speed']
         self.wind_direction = json['wind_deg']
-        self.wind_gust = json['wind_gust'] if 'wind_gust' in json else None
+        self.wind_gust = get_s('wind_gust', json)
         self.weather = [Weather(w) for w in get_s('weather', json, [])]
         self.rain = get_s('rain', json)
         self.pop = get_s('pop', json)
 
+    @property
+    def time(self):
+        return _datetime(self.dt)
+
+    @property
+    def sunrise(self):
+        return _datetime(self.sunrise_dt)
+
+    @property
+    def sunset(self):
+        return _datetime(self.sunset_dt)
+
 
 class Alert:
+    __slots__ = ('authority', 'event', 'start_dt', 'end_dt', 'description')
+
     def __init__(self, json) -> None:
         self.authority = get_s('sender_name', json, '')
         self.event = json['event']
-        self.start = datetime.datetime.fromtimestamp(json['start'])
-        self.end = datetime.datetime.fromtimestamp(json['end'])
+        self.start_dt = json['start']
+        self.end_dt = json['end']
         self.description = get_s('description', json, '')
 
+    @property
+    def start(self):
+        return _datetime(self.start_dt)
+
+    @property
+    def end(self):
+        return _datetime(self.end_dt)
+
 
 class WeatherDataPoint:
+    __slots__ = ('dt', 'sunrise_dt', 'sunset_dt', 'temperature', 'feels_like', 'pressure', 'humidity',
+                 'dew_point', 'uvi', 'clouds', 'visibility', 'wind_speed', 'wind_direction', 'wind_gust',
+                 'rain', 'pop', 'weather')
+
     def __init__(self, json) -> None:
-        self.time = datetime.datetime.fromtimestamp(json['dt'])
-        self.sunrise = get_f('sunrise', json, datetime.datetime.fromtimestamp)
-        self.sunset = get_f('sunset', json, datetime.datetime.fromtimestamp)
+        self.dt = json['dt']
+        self.sunrise_dt = get_s('sunrise', json)
+        self.sunset_dt = get_s('sunset', json)
         self.temperature = json['temp']
         self.feels_like = get_s('feels_like', json)
         self.pressure = json['pressure']
@@ -95,26 +131,116 @@ class WeatherDataPoint:
         self.dew_point = get_s('dew_point', json)
         self.uvi = get_s('uvi', json)
         self.clouds = json['clouds']
-        self.visibility = json['visibility']
+        self.visibility = get_s('visibility', json)
         self.wind_speed = json['wind_speed']
         self.wind_direction = json['wind_deg']
         self.wind_gust = get_s('wind_gust', json)
-        if 'rain' in json:
-            self.rain = json['rain']['1h']
+        self.rain = json['rain']['1h'] if 'rain' in json else None
         self.pop = get_s('pop', json)
 
         self.weather = [Weather(w) for w in get_s('weather', json, [])]
 
+    @property
+    def time(self):
+        return _datetime(self.dt)
+
+    @property
+    def sunrise(self):
+        return _datetime(self.sunrise_dt)
+
+    @property
+    def sunset(self):
+        return _datetime(self.sunset_dt)
+
+
+class MinutelySeries:
+    """Minutely precipitation forecast stored as columns"""
+    __slots__ = ('time', 'precipitation')
+
+    def __init__(self, json) -> None:
+        self.time = array('q', [m['dt'] for m in json])
+        self.precipitation = array('d', [m['precipitation'] for m in json])
+
+    def __len__(self):
+        return len(self.time)
+
+
+class HourlySeries:
+    """Hourly forecast stored as columns: unix timestamp, temperature, probability of
+       precipitation and precipitation volume for the hour"""
+    __slots__ = ('time', 'temperature', 'pop', 'precipitation')
+
+    def __init__(self, json) -> None:
+        self.time = array('q', [h['dt'] for h in json])
+        self.temperature = array('d', [h['temp'] for h in json])
+        self.pop = array('d', [get_s('pop', h, 0.0) for h in json])
+        self.precipitation = array(
+            'd', [h['rain']['1h'] if 'rain' in h else 0.0 for h in json])
+
+    def __len__(self):
+        return len(self.time)
+
 
 class WeatherInfo:
+    """One Call API response. Sections are parsed on the first access.
+
+       Drawing and weather jobs read the same instance from different threads, parsing is
+       done under the lock so every section is parsed exactly once"""
+    __slots__ = ('_json', '_lock', '_current', '_minutely',
+                 '_hourly', '_daily', '_alerts')
+
+    # One Call section -> property parsing it
+    _properties = {'minutely': 'minutely_precipitation'}
+
     def __init__(self, json):
-        current = json['current']
-        self.current = WeatherDataPoint(current)
-        self.minutely_precipitation = [
-            MinutelyPrecipitation(m) for m in get_s('minutely', json, [])]
-        self.hourly = [WeatherDataPoint(h) for h in get_s('hourly', json, [])]
-        self.daily = [DailyForecast(d) for d in get_s('daily', json, [])]
-        self.alerts = [Alert(a)for a in get_s('alerts', json, [])]
+        self._json = dict(json)
+        self._lock = threading.Lock()
+        self._current = None
+        self._minutely = None
+        self._hourly = None
+        self._daily = None
+        self._alerts = None
+
+    def _section(self, attribute, name, parse, default):
+        value = getattr(self, attribute)
+        if value is None:
+            with self._lock:
+                value = getattr(self, attribute)
+                if value is None:
+                    # raw section is kept if parsing fails and released once parsed
+                    value = parse(self._json.get(name, default))
+                    setattr(self, attribute, value)
+                    self._json.pop(name, None)
+        return value
+
+    def release(self, keep):
+        """Parses sections listed in keep and releases the rest of the raw response"""
+        for section in keep:
+            getattr(self, self._properties.get(section, section))
+        with self._lock:
+            self._json.clear()
+
+    @property
+    def current(self) -> WeatherDataPoint:
+        """Current conditions, None if the response has none"""
+        return self._section('_current', 'current',
+                             lambda current: WeatherDataPoint(current) if current is not None else None, None)
+
+    @property
+    def minutely_precipitation(self) -> MinutelySeries:
+        return self._section('_minutely', 'minutely', MinutelySeries, [])
+
+    @property
+    def hourly(self) -> HourlySeries:
+        return self._section('_hourly', 'hourly', HourlySeries, [])
+
+    @property
+    def daily(self):
+        return self._section('_daily', 'daily', lambda daily: [DailyForecast(d) for d in daily], [])
+
+    @property
+    def alerts(self):
+        return self._section('_alerts', 'alerts', lambda alerts: [Alert(a) for a in alerts], [])
 
 
 _compass = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE",
@@ -129,10 +255,16 @@ def wind_direction_to_compass(direction: int) -> str:
 class OpenWeatherMap:
     BASE_URL = 'https://api.openweathermap.org/data/2.5/onecall'
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, client: HttpClient = None, base_url=None):
         self.api_key = api_key
-
-    def query(self, position: Position, units='metric', **kwargs):
+        self.client = client if client is not None else HttpClient()
+        # base_url can point to a caching proxy (see weatherproxy.py) instead of OpenWeatherMap
+        self.base_url = base_url if base_url is not None else self.BASE_URL
+        self.etags = {}  # request params -> (ETag, body) of the last response
+
+    def fetch(self, position: Position, units='metric', **kwargs) -> bytes:
+        """Returns raw JSON response body. If the server supports ETags and the data didn't change,
+           body of the previous response is returned"""
         params = {
             'lon': position.lon,
             'lat': position.lat,
@@ -143,12 +275,30 @@ class OpenWeatherMap:
         for k, v in kwargs.items():
             params[k] = v
 
-        response = requests.get(self.BASE_URL, params=params)
+        key = tuple(sorted(params.items()))
+        headers = None
+        if key in self.etags:
+            headers = {'If-None-Match': self.etags[key][0]}
+
+        start = time.perf_counter()
+        response = self.client.get(
+            self.base_url, params=params, headers=headers)
+        metrics.WEATHER_SECONDS.observe(time.perf_counter() - start)
+        metrics.WEATHER_RESPONSES.inc(status=response.status_code)
+        metrics.WEATHER_BYTES.inc(len(response.content))
+        if response.status_code == 304 and key in self.etags:
+            return self.etags[key][1]
         if response.status_code != 200:
             raise Exception(
                 f'Error calling OpenWeatherMap API. Status: {response.status_code} {response.reason}, Message: {response.text}')
 
-        return WeatherInfo(response.json())
+        etag = response.headers.get('ETag', None)
+        if etag is not None:
+            self.etags[key] = (etag, response.content)
+        return response.content
+
+    def query(self, position: Position, units='metric', **kwargs):
+        return WeatherInfo(json.loads(self.fetch(position, units, **kwargs)))
 
 
 # Usage
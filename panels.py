@@ -0,0 +1,152 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+from collections import deque
+
+from PIL import Image
+
+import timesource
+
+
+def pack_image(image, width, height, out=None):
+    """Packs 1-bit image into the panel byte layout: rows of panel's native (portrait) orientation,
+       8 pixels per byte, most significant bit first, bit is set for white pixel.
+
+       This is the layout of PIL mode '1' images, so packing is a single transpose for landscape
+       images and a copy, both done in C"""
+    if image.size == (height, width):
+        image = image.transpose(Image.ROTATE_90)
+    elif image.size != (width, height):
+        raise ValueError(
+            f'Image size {image.size} does not match panel size {(width, height)}')
+    if image.mode != '1':
+        image = image.convert('1')
+    data = image.tobytes()
+    if out is None:
+        return bytearray(data)
+    out[:] = data
+    return out
+
+
+class Panel:
+    """Display backend. Panel is described by its native (portrait) width and height,
+       it receives frames as a pair of black and red buffers produced by getbuffer()
+
+       Panels that can refresh only part of the screen also provide
+       display_partial(black, red, regions)"""
+    width = 0
+    height = 0
+
+    def init(self):
+        pass
+
+    def getbuffer(self, image, plane=0):
+        """Packs image for the color plane. Buffer is reused for the next frame"""
+        if not hasattr(self, 'buffers'):
+            size = (self.width + 7) // 8 * self.height
+            self.buffers = (bytearray(size), bytearray(size))
+        return pack_image(image, self.width, self.height, self.buffers[plane])
+
+    def display(self, black, red):
+        raise NotImplementedError()
+
+    def sleep(self):
+        pass
+
+
+class Epd2in7bPanel(Panel):
+    """Waveshare 2.7" 3-color e-Paper HAT (B)"""
+
+    def __init__(self, config):
+        import waveshare_epd.epd2in7b as epd
+        self.epd = epd.EPD()
+        self.width = self.epd.width
+        self.height = self.epd.height
+
+    def init(self):
+        self.epd.init()
+
+    def display(self, black, red):
+        self.epd.display(black, red)
+
+    def sleep(self):
+        self.epd.sleep()
+
+
+class HeadlessPanel(Panel):
+    """In-memory panel for running without the hardware.
+
+       Keeps last `history` frames in memory and optionally writes them to `output_dir`
+       either as PNG images or as raw 1-bit planes. `refresh_latency` seconds are spent
+       in display() to simulate e-ink refresh time"""
+
+    def __init__(self, config):
+        self.width, self.height = config.get('size', (176, 264))
+        self.output_dir = config.get('output_dir', None)
+        self.output_format = config.get('format', 'png')
+        self.refresh_latency = config.get('refresh_latency', 0)
+        self.frames = deque(maxlen=config.get('history', 1))
+        self.frame_count = 0
+        self.last_regions = None
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+    def display(self, black, red):
+        if self.refresh_latency > 0:
+            timesource.sleep(self.refresh_latency)
+        self.frame_count += 1
+        # buffers are reused by getbuffer(), keep copies
+        black, red = bytes(black), bytes(red)
+        self.frames.append((black, red))
+        if self.output_dir is not None:
+            self._save(black, 'black')
+            self._save(red, 'red')
+
+    def display_partial(self, black, red, regions):
+        self.last_regions = regions
+        self.display(black, red)
+
+    def image(self, buffer):
+        """Converts buffer back to the image in native orientation"""
+        return Image.frombytes('1', (self.width, self.height), buffer)
+
+    def _save(self, buffer, plane):
+        name = os.path.join(self.output_dir,
+                            f'frame-{self.frame_count:06d}-{plane}')
+        if self.output_format == 'raw':
+            with open(name + '.raw', 'wb') as f:
+                f.write(buffer)
+        else:
+            self.image(buffer).save(name + '.png')
+
+
+backends = {
+    'epd2in7b': Epd2in7bPanel,
+    'headless': HeadlessPanel,
+}
+
+
+def create_panel(config) -> Panel:
+    """Creates display backend described by the "display" section of the configuration"""
+    backend = config.get('backend', 'epd2in7b')
+    if backend not in backends:
+        raise ValueError(f'Unknown display backend: {backend}')
+    return backends[backend](config)
@@ -21,23 +21,116 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import sys
+import startup
+if '--startup-report' in sys.argv:
+    startup.enable()
 
-from settings import Settings
-from gpiozero import Button
-
-import time
+import os
+import gc
+import json
+import zlib
+import struct
 import datetime
+import signal
 import threading
 import traceback
 
+from settings import Settings
+from resources import Resources
 from display import Display, Layout
-from openweathermap import OpenWeatherMap, Position
-from intervals import repeating
+from openweathermap import OpenWeatherMap, Position, WeatherInfo
+from httpclient import HttpClient
+from intervals import Scheduler
+from refresh import RefreshQueue
+from polling import PollingPolicy, exclude
+from presence import PresenceSensor
+from recorder import Recorder, RecordingWeather
+from memory import MemoryMonitor
+from history import WeatherHistory
+import profiler
+import state
+import metrics
+import timesource
+
+startup.mark('imports')
+
+
+class Screen:
+    """One display with its own settings, layout and refresh queue"""
+
+    def __init__(self, settings: Settings, resources: Resources):
+        self.settings = settings
+        self.display = Display(settings, resources.text_cache)
+        self.layout = Layout(self.display, settings, resources)
+        self.refresh = RefreshQueue(self.layout)
+
+    def weather_key(self):
+        """Screens with the same key show the same forecast. Coordinates are rounded
+           to about 1 km, much finer than the forecast grid"""
+        position = self.settings.position
+        return (round(position['lat'], 2), round(position['lon'], 2), self.settings.get('units', 'metric'))
 
 
 class Controller:
+    CLOCK_INTERVAL = 120
+
     def __init__(self, settings: Settings):
-        display = Display(settings)
+        self.settings = settings
+        # low memory mode trades CPU for smaller caches, see trim_memory()
+        self.low_memory = bool(settings.low_memory)
+        self.resources = Resources(low_memory=self.low_memory)
+        self.screens = [Screen(display_settings, self.resources)
+                        for display_settings in settings.displays()]
+        startup.mark('display')
+
+        self.scheduler = Scheduler()
+        # first screen is the one with buttons
+        self.layout = self.screens[0].layout
+        self.refresh = self.screens[0].refresh
+        self.weather_groups = {}
+        for screen in self.screens:
+            self.weather_groups.setdefault(
+                screen.weather_key(), []).append(screen)
+        # last weather responses and frame hashes are kept across restarts
+        self.state_path = None
+        if settings.cache_dir is not None and settings.get('state', True):
+            self.state_path = os.path.join(settings.cache_dir, 'state.bin')
+            # hashes are saved as soon as a frame is pushed, so they survive a power cut
+            for screen in self.screens:
+                screen.display.on_show = self.frame_shown
+        self.weather_bodies = {}
+        # state is saved from the weather job and the refresh threads of all displays
+        self.state_lock = threading.RLock()
+        self.histories = {}
+        if settings.cache_dir is not None and settings.get('history', {}) is not None:
+            self.setup_history(settings.get('history', {}))
+        self.memory = MemoryMonitor(self)
+        self.state_job = None
+        self.clock_job = None
+        self.metrics_server = None
+        self.presence = None
+        # clock refresh interval while nobody is around, see setup_presence()
+        self.absent_interval = settings.get(
+            'presence', {}).get('absent_interval', 30*60)
+        # seconds before the minute flips the next clock frame is rendered
+        self.render_ahead = settings.get('render_ahead', 10)
+        self.polling = PollingPolicy(**settings.get('polling', {}))
+        self.openweathermap = None
+        if settings.openweathermap_api_key is not None or settings.openweathermap_url is not None:
+            self.openweathermap = OpenWeatherMap(
+                settings.openweathermap_api_key, HttpClient(**settings.get('http', {})), settings.openweathermap_url)
+        self.recorder = None
+        if settings.record is not None:
+            # weather responses and button presses are recorded for replay.py
+            self.recorder = Recorder(settings.record)
+            if self.openweathermap is not None:
+                self.openweathermap = RecordingWeather(
+                    self.openweathermap, self.recorder)
+        startup.mark('layout')
+
+    def setup_buttons(self):
+        from gpiozero import Button
 
         self.button1 = Button(5)
         self.button2 = Button(6)
@@ -45,55 +138,269 @@ class Controller:
         self.button4 = Button(19)
 
         self.button1.when_pressed = self.button1pressed
+        # holding buttons 3 and 4 together starts profiling
+        for button in (self.button3, self.button4):
+            button.hold_time = 2
+            button.when_held = self.buttons_held
 
-        self.settings = settings
-        self.layout = Layout(display, settings)
-        if settings.openweathermap_api_key is not None:
-            self.openweathermap = OpenWeatherMap(
-                settings.openweathermap_api_key)
-            self.get_forecast()
+    def setup_metrics(self):
+        """Metrics are always recorded, HTTP endpoint and JSON file are enabled in the config"""
+        config = self.settings.get('metrics', {})
+        if 'port' in config:
+            try:
+                self.metrics_server = metrics.MetricsServer(
+                    config.get('address', '127.0.0.1'), config['port'])
+                self.metrics_server.start()
+            except OSError as ex:
+                print(f'Failed to start metrics endpoint: {ex}')
+        if 'json' in config:
+            self.scheduler.every(config.get('flush_interval', 60), metrics.write_json, config['json'],
+                                 background=True, name='metrics flush')
+        self.scheduler.every(self.settings.get('memory', {}).get('interval', 600), self.memory.sample,
+                             run_now=True, name='memory sample')
+        if self.low_memory:
+            self.scheduler.every(3600, self.trim_memory)
+
+    def setup_history(self, config):
+        """Observed weather is kept for every location in the cache directory"""
+        os.makedirs(self.settings.cache_dir, exist_ok=True)
+        for key, screens in self.weather_groups.items():
+            lat, lon, units = key
+            path = os.path.join(self.settings.cache_dir,
+                                f'history-{lat}-{lon}-{units}.bin')
+            try:
+                history = WeatherHistory(path, config.get(
+                    'capacity', 4 * 24 * 30))
+            except (OSError, ValueError) as ex:
+                print(f'Weather history is not kept: {ex}')
+                continue
+            self.histories[key] = history
+            for screen in screens:
+                screen.layout.weather.history = history
 
-    def run(self):
-        self.refresh_display()
-        self.update_weather()
+    def setup_presence(self):
+        config = self.settings.get('presence', {})
+        if 'port' in config:
+            self.presence = PresenceSensor(config['port'], config.get(
+                'baudrate', 9600), self.presence_changed)
+            self.presence.start()
 
-        def dummy_thread():
-            while True:
-                time.sleep(15)
+    def trim_memory(self):
+        self.resources.trim()
+        gc.collect()
 
-        threading.Thread(target=dummy_thread).start()  # keep app alive
+    def dump_memory(self):
+        """Writes memory report to the cache directory, first call starts allocation tracing"""
+        directory = self.settings.cache_dir or '.'
+        os.makedirs(directory, exist_ok=True)
+        self.memory.dump(os.path.join(
+            directory, f'memory-{timesource.now():%Y%m%d-%H%M%S}.txt'))
+
+    def clock_interval(self):
+        if self.presence is not None and self.presence.present is False:
+            return self.absent_interval
+        return self.CLOCK_INTERVAL
+
+    def run(self, buttons=True):
+        """Runs the clock on the current thread until stop() is called.
+
+           First frame is drawn before buttons are set up and weather forecast is
+           requested, with the weather saved before the restart. If the display already
+           shows this frame, it is not refreshed. Forecast is fetched in background"""
+        self.restore_state()
+        # the frame for the current clock interval, the same one periodic refresh would show
+        now = datetime.datetime.fromtimestamp(
+            timesource.time() // self.CLOCK_INTERVAL * self.CLOCK_INTERVAL)
+        for screen in self.screens:
+            screen.layout.draw(now)
+        startup.mark('first frame')
+        startup.report()
+
+        for screen in self.screens:
+            screen.refresh.start()
+        self.setup_metrics()
+        if buttons:
+            self.setup_buttons()
+        self.setup_presence()
+        self.clock_job = self.scheduler.every(self.clock_interval, self.refresh_display,
+                                              align=True, offset=-self.render_ahead)
+        if self.openweathermap is not None:
+            for key in self.weather_groups:
+                self.scheduler.every(lambda key=key: self.polling.interval(key), self.update_weather, key,
+                                     run_now=True, background=True, name=f'weather {key}')
+        self.scheduler.run()
+
+    def restore_state(self):
+        if self.state_path is None or not os.path.isfile(self.state_path):
+            return
+        try:
+            saved = state.load(self.state_path)
+        except (OSError, ValueError, struct.error, zlib.error) as ex:
+            print(f'Ignoring saved state: {ex}')
+            return
+        max_age = self.settings.get('state_max_age', 12 * 3600)
+        for key, (fetched, body) in saved.weather.items():
+            if key not in self.weather_groups or timesource.time() - fetched > max_age:
+                continue
+            try:
+                weather = WeatherInfo(json.loads(body))
+                # parsed now so a broken entry fails here and not in the first frame,
+                # the body has only the sections the layouts draw anyway
+                weather.release(self.weather_sections(key))
+            except (ValueError, KeyError, TypeError) as ex:
+                # forecast is fetched again right after start
+                print(f'Ignoring saved weather for {key}: {ex}')
+                continue
+            self.weather_bodies[key] = (fetched, body)
+            for screen in self.weather_groups[key]:
+                screen.layout.weather.update(weather)
+        if len(saved.hashes) == len(self.screens):
+            for screen, hashes in zip(self.screens, saved.hashes):
+                if None not in hashes:
+                    screen.display.last_hashes = hashes
+
+    def save_state(self):
+        if self.state_path is None:
+            return
+        with self.state_lock:
+            current = state.State()
+            current.weather = dict(self.weather_bodies)
+            current.hashes = [
+                screen.display.last_hashes for screen in self.screens]
+            try:
+                os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+                state.save(self.state_path, current)
+            except (OSError, ValueError) as ex:
+                print(f'Failed to save state: {ex}')
+
+    def frame_shown(self, hashes):
+        """Rewrites only the frame hashes in the state file, the whole file if it isn't there yet"""
+        with self.state_lock:
+            try:
+                state.save_hashes(self.state_path, [
+                    screen.display.last_hashes for screen in self.screens])
+            except (OSError, ValueError, struct.error):
+                self.save_state()
+
+    def stop(self):
+        self.scheduler.shutdown()
+        if self.presence is not None:
+            self.presence.stop()
+        for screen in self.screens:
+            screen.refresh.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        for history in self.histories.values():
+            history.close()
+        self.save_state()
 
     def button1pressed(self):
         print("button 1 pressed")
-        self.layout.weather.set_state(self.layout.weather.CURRENT_DETAILS)
-        self.layout.draw()
+        if self.recorder is not None:
+            self.recorder.record('button', button=1)
+        weather = self.layout.weather
+        weather.set_state(weather.CURRENT_DETAILS)
+        if self.state_job is not None:
+            self.scheduler.cancel(self.state_job)
+        self.state_job = self.scheduler.call_later(25, self.reset_state)
+        self.refresh.request(RefreshQueue.USER, 'button 1')
 
-    def get_forecast(self):
+    def buttons_held(self):
+        if self.button3.is_held and self.button4.is_held:
+            self.start_profiler()
+
+    def start_profiler(self):
+        config = self.settings.get('profiler', {})
+        directory = config.get('dir', os.path.join(
+            self.settings.cache_dir or '.', 'profiles'))
+        profiler.start(directory, config.get('frames', 3),
+                       weather=self.openweathermap is not None)
+
+    def presence_changed(self, present):
+        """Clock is refreshed rarely while nobody is around and right away when somebody comes"""
+        if self.clock_job is not None:
+            self.scheduler.reschedule(self.clock_job)
+        if present:
+            for screen in self.screens:
+                screen.refresh.request(RefreshQueue.USER, 'presence')
+
+    def reset_state(self):
+        self.state_job = None
+        self.layout.weather.set_state(self.layout.weather.DEFAULT)
+        self.refresh.request(RefreshQueue.PERIODIC, 'details timeout')
+
+    def weather_sections(self, key):
+        """One Call sections drawn by the layouts showing weather for the key"""
+        sections = set()
+        for screen in self.weather_groups[key]:
+            sections.update(screen.layout.weather.SECTIONS)
+        return sections
+
+    def get_forecast(self, key):
+        """Fetches forecast once for all screens showing weather at the same place"""
+        lat, lon, units = key
+        screens = self.weather_groups[key]
+        sections = self.weather_sections(key)
+        excluded = exclude(sections)
+        kwargs = {'exclude': excluded} if excluded is not None else {}
+        weather = None
         try:
-            print('getting new forecast')
-            weather = self.openweathermap.query(
-                Position(self.settings.position['lat'], self.settings.position['lon']), self.settings.get('units', 'metric'))
-            if weather is not None:
-                self.layout.weather.update(weather)
+            print(f'getting new forecast for {lat}, {lon}')
+            body = self.openweathermap.fetch(
+                Position(lat, lon), units, **kwargs)
+            weather = WeatherInfo(json.loads(body))
+            self.weather_bodies[key] = (timesource.time(), body)
+            self.save_state()
+            if key in self.histories:
+                self.histories[key].append_weather(weather)
+            if self.low_memory:
+                # keep only parsed sections the layouts draw
+                weather.release(sections)
+            for screen in screens:
+                first = screen.layout.weather.weather_info is None
+                screen.layout.weather.update(weather)
+                if first:
+                    # first frame was drawn without weather
+                    screen.refresh.request(
+                        RefreshQueue.PERIODIC, 'first forecast')
         except Exception as ex:
             print(f'Failed to update weather: {ex}')
-            traceback.print_exc(ex)
-
-    def redraw_display(self):
-        """Draws display"""
-        self.layout.draw()
+            traceback.print_exc()
+        try:
+            self.polling.record(key, weather)
+        except Exception as ex:
+            # e.g. malformed hourly section, counted as a failed request
+            print(f'Failed to update polling interval: {ex}')
+            traceback.print_exc()
+            self.polling.record(key, None)
+        if self.low_memory:
+            gc.collect()
 
-    @repeating(lambda: 120 - datetime.datetime.now().second)
     def refresh_display(self):
-        self.redraw_display()
+        # job runs render_ahead seconds before the clock boundary the frame is for
+        target = round((timesource.time() + self.render_ahead) /
+                       self.CLOCK_INTERVAL) * self.CLOCK_INTERVAL
+        for screen in self.screens:
+            screen.refresh.request_at(target, 'clock')
 
-    @repeating(lambda: 15*60)
-    def update_weather(self):
-        self.get_forecast()
+    def update_weather(self, key):
+        profiler.profile(profiler.WEATHER, self.get_forecast, key)
 
 
 if __name__ == '__main__':
 
-    controller = Controller(Settings())
+    settings = Settings()
+    startup.mark('settings')
+    controller = Controller(settings)
 
-    controller.run()
+    signal.signal(signal.SIGTERM, lambda signum, frame: controller.stop())
+    signal.signal(signal.SIGUSR1, lambda signum, frame: controller.scheduler.call_later(
+        0, controller.start_profiler))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: controller.scheduler.call_later(
+        0, controller.dump_memory))
+    try:
+        controller.run()
+    except KeyboardInterrupt:
+        controller.stop()
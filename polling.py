@@ -0,0 +1,122 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+
+import timesource
+
+# One Call sections, the ones not drawn by any layout are excluded from requests
+SECTIONS = ('current', 'minutely', 'hourly', 'daily', 'alerts')
+
+
+def exclude(needed):
+    """Value of One Call exclude parameter for the set of needed sections, None if all are needed"""
+    excluded = [section for section in SECTIONS if section not in needed]
+    return ','.join(excluded) if excluded else None
+
+
+class PollState:
+    __slots__ = ('interval', 'temperature', 'pop', 'failures')
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.temperature = None
+        self.pop = None
+        self.failures = 0  # consecutive failed requests
+
+
+class PollingPolicy:
+    """Decides when to request weather next.
+
+       Interval shrinks when displayed values change between requests or precipitation
+       becomes likely, and grows while they are stable. After failed requests interval
+       starts from the shortest one and doubles up to the normal one. Over night (the hours
+       may wrap past midnight, e.g. 22 to 6) the longest interval is used. Requests for all
+       positions share daily budget, interval is never shorter than needed to spread the
+       remaining budget till midnight"""
+
+    # changes of displayed values considered significant
+    TEMPERATURE_STEP = 1.0
+    POP_STEP = 0.2
+
+    def __init__(self, interval=15*60, min_interval=5*60, max_interval=60*60, daily_budget=1000, night=(0, 6)):
+        self.base_interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.daily_budget = daily_budget
+        self.night = tuple(night)
+        self.states = {}
+        self.day = None
+        self.calls = 0
+
+    def record(self, key, weather_info, now=None):
+        """Records the request made for the key, weather_info is None if request failed.
+           Response without current conditions counts as failed"""
+        now = now if now is not None else timesource.now()
+        if now.date() != self.day:
+            self.day = now.date()
+            self.calls = 0
+        self.calls += 1
+
+        state = self.states.setdefault(key, PollState(self.base_interval))
+        if weather_info is None or weather_info.current is None:
+            # retry soon, then back off so the budget isn't spent while upstream is down
+            state.failures += 1
+            state.interval = min(max(self.base_interval, self.min_interval),
+                                 self.min_interval * 2 ** (state.failures - 1))
+            return
+        state.failures = 0
+        temperature = weather_info.current.temperature
+        pop = max(weather_info.hourly.pop[0:3], default=0.0)
+        if state.temperature is None:
+            state.interval = self.base_interval
+        else:
+            change = abs(temperature - state.temperature) / self.TEMPERATURE_STEP + \
+                abs(pop - state.pop) / self.POP_STEP
+            if pop > state.pop or change >= 1:
+                state.interval = max(self.min_interval, state.interval / 2)
+            elif change < 0.5:
+                state.interval = min(self.max_interval, state.interval * 1.5)
+        state.temperature = temperature
+        state.pop = pop
+
+    def is_night(self, now):
+        start, end = self.night
+        if start <= end:
+            return start <= now.hour < end
+        return now.hour >= start or now.hour < end
+
+    def interval(self, key, now=None):
+        """Seconds till the next request for the key"""
+        now = now if now is not None else timesource.now()
+        state = self.states.get(key, None)
+        interval = state.interval if state is not None else self.base_interval
+        if self.is_night(now):
+            interval = max(interval, self.max_interval)
+
+        midnight = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time())
+        seconds_left = (midnight - now).total_seconds()
+        remaining = self.daily_budget - (self.calls if now.date() == self.day else 0)
+        if remaining <= 0:
+            print('Daily weather request budget is used up')
+            return seconds_left + 1
+        keys = max(1, len(self.states))
+        return max(interval, seconds_left * keys / remaining)
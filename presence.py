@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Presence events from the proximity sensor connected to the Arduino running light.ino.
+# The sketch prints "PRESENT" when somebody comes close and "ABSENT" when nobody was
+# seen for a while, current state is repeated every minute. To watch the events:
+#
+#    ./presence.py /dev/ttyUSB0
+#
+# Without the Arduino, a fake device on a pseudo terminal sends events typed on stdin:
+#
+#    ./presence.py --fake
+
+import os
+import sys
+import time
+import argparse
+import threading
+import traceback
+
+PRESENT = 'PRESENT'
+ABSENT = 'ABSENT'
+
+
+class PresenceSensor:
+    """Reads presence events from serial port on a background thread.
+
+       on_change(present) is called on the reader thread when presence changes. Port is
+       reopened if the Arduino is disconnected"""
+
+    RECONNECT_DELAY = 10
+
+    def __init__(self, port, baudrate=9600, on_change=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.on_change = on_change
+        self.present = None  # unknown until the first event
+        self.last_event = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='presence', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def feed(self, line):
+        """Handles one line received from the device"""
+        event = line.strip().upper()
+        if event not in (PRESENT, ABSENT):
+            return
+        self.last_event = time.time()
+        present = event == PRESENT
+        if present != self.present:
+            self.present = present
+            print(f'presence: {event.lower()}')
+            if self.on_change is not None:
+                try:
+                    self.on_change(present)
+                except Exception:
+                    traceback.print_exc()
+
+    def _run(self):
+        # pyserial is needed only if the sensor is configured
+        import serial
+        while self._running:
+            try:
+                with serial.Serial(self.port, self.baudrate, timeout=1) as device:
+                    while self._running:
+                        line = device.readline()
+                        if line:
+                            self.feed(line.decode('ascii', errors='ignore'))
+            except (serial.SerialException, OSError) as ex:
+                print(f'Presence sensor {self.port} failed: {ex}')
+                time.sleep(self.RECONNECT_DELAY)
+
+
+class FakeDevice:
+    """Pseudo terminal standing in for the Arduino, path is the port to open"""
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        self.path = os.ttyname(self.slave)
+
+    def send(self, event):
+        os.write(self.master, (event + '\r\n').encode('ascii'))
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print presence events')
+    parser.add_argument('port', nargs='?')
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--fake', action='store_true',
+                        help='read from a fake device, type present/absent to send events')
+    args = parser.parse_args()
+
+    fake = FakeDevice() if args.fake else None
+    port = fake.path if fake is not None else args.port
+    if port is None:
+        parser.error('port is required')
+    sensor = PresenceSensor(port, args.baudrate)
+    sensor.start()
+    try:
+        if fake is not None:
+            for line in sys.stdin:
+                fake.send(line.strip())
+        else:
+            while True:
+                time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# On-demand profiling of the running clock. start() arms a capture: the next N
+# frames and the next weather request are run under cProfile while a sampler thread
+# collects their stacks. For every kind a pstats file and a collapsed stack file
+# (input of flamegraph.pl) are written:
+#
+#    profile-20201028-153012-frame.pstats
+#    profile-20201028-153012-frame.folded
+#
+# While no capture is armed profile() just calls the function.
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import datetime
+import threading
+from collections import Counter
+
+FRAME = 'frame'
+WEATHER = 'weather'
+
+active = None
+_lock = threading.Lock()
+
+
+def profile(kind, func, *args, count=True):
+    """Calls func(*args), profiled if a capture of this kind is armed. count=False
+       profiles the call as part of the next counted one"""
+    capture = active
+    if capture is None or not capture.wants(kind):
+        return func(*args)
+    return capture.run(kind, func, args, count)
+
+
+def start(output_dir, frames=3, weather=True, interval=0.005, timeout=3600):
+    """Arms a capture unless one is already running, returns True if armed.
+       Capture is written as is if the calls don't happen within timeout seconds"""
+    global active
+    with _lock:
+        if active is not None:
+            return False
+        os.makedirs(output_dir, exist_ok=True)
+        active = Capture(output_dir, frames, weather, interval, timeout)
+    print(f'Profiling next {frames} frames' +
+          (' and weather request' if weather else ''))
+    return True
+
+
+def _finished(capture):
+    global active
+    with _lock:
+        if active is capture:
+            active = None
+
+
+def collapse(frame):
+    """Stack of the frame as "file:function;..." from the outermost call"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Capture:
+    def __init__(self, output_dir, frames, weather, interval, timeout):
+        self.prefix = os.path.join(
+            output_dir, f'profile-{datetime.datetime.now():%Y%m%d-%H%M%S}')
+        self.interval = interval
+        self.deadline = time.monotonic() + timeout
+        self.remaining = {FRAME: frames, WEATHER: 1 if weather else 0}
+        self.stats = {FRAME: None, WEATHER: None}
+        self.stacks = {FRAME: Counter(), WEATHER: Counter()}
+        self.threads = {}  # thread id -> kind being profiled on it
+        self.lock = threading.Lock()
+        self.sampler = threading.Thread(
+            target=self._sample, name='profiler', daemon=True)
+        self.sampler.start()
+
+    def wants(self, kind):
+        return self.remaining[kind] > 0
+
+    def run(self, kind, func, args, count):
+        thread = threading.get_ident()
+        with self.lock:
+            self.threads[thread] = kind
+        profiler = cProfile.Profile()
+        try:
+            try:
+                profiler.enable()
+            except ValueError as ex:
+                # Python 3.12+ runs one cProfile profiler at a time, e.g. when the weather request is
+                # profiled during a frame. Stacks of this call are still sampled
+                print(f'Not profiling {kind}: {ex}')
+                profiler = None
+            return func(*args)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            with self.lock:
+                del self.threads[thread]
+                if profiler is not None:
+                    if self.stats[kind] is None:
+                        self.stats[kind] = pstats.Stats(profiler)
+                    else:
+                        self.stats[kind].add(profiler)
+                done = False
+                if count and self.remaining[kind] > 0:
+                    self.remaining[kind] -= 1
+                    done = self.remaining[kind] == 0
+            if done:
+                self._write(kind)
+                if not any(self.remaining.values()):
+                    _finished(self)
+
+    def _sample(self):
+        while any(self.remaining.values()):
+            if time.monotonic() > self.deadline:
+                self._expire()
+                return
+            time.sleep(self.interval)
+            with self.lock:
+                threads = dict(self.threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for thread, kind in threads.items():
+                    if thread in frames:
+                        self.stacks[kind][collapse(frames[thread])] += 1
+
+    def _expire(self):
+        with self.lock:
+            pending = [kind for kind, remaining in self.remaining.items()
+                       if remaining > 0]
+            for kind in pending:
+                self.remaining[kind] = 0
+        for kind in pending:
+            if self.stats[kind] is not None:
+                self._write(kind)
+        print('Profiling timed out')
+        _finished(self)
+
+    def _write(self, kind):
+        with self.lock:
+            stats = self.stats[kind]
+            stacks = self.stacks[kind]
+            self.stacks[kind] = Counter()
+        if stats is not None:
+            stats.dump_stats(f'{self.prefix}-{kind}.pstats')
+        with open(f'{self.prefix}-{kind}.folded', 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        print(f'Profile written to {self.prefix}-{kind}.*')
@@ -0,0 +1,91 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Records weather responses and button presses, so that a day can be replayed
+# later with replay.py. Every event is one JSON line with clock time "t" and "type"
+
+import json
+import threading
+
+import timesource
+from openweathermap import Position, WeatherInfo
+
+
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def record(self, kind, **fields):
+        event = dict(t=timesource.time(), type=kind, **fields)
+        line = json.dumps(event)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load(path):
+    """Returns recorded events ordered by time"""
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda e: e['t'])
+
+
+class RecordingWeather:
+    """Weather source recording every response of the upstream OpenWeatherMap"""
+
+    def __init__(self, upstream, recorder: Recorder):
+        self.upstream = upstream
+        self.recorder = recorder
+
+    def fetch(self, position: Position, units='metric', **kwargs) -> bytes:
+        body = self.upstream.fetch(position, units, **kwargs)
+        self.recorder.record('weather', lat=position.lat, lon=position.lon, units=units,
+                             body=body.decode('utf-8'))
+        return body
+
+    def query(self, position: Position, units='metric', **kwargs):
+        return WeatherInfo(json.loads(self.fetch(position, units, **kwargs)))
+
+
+class ReplayWeather:
+    """Weather source returning the latest recorded response for the position"""
+
+    def __init__(self, events):
+        self.responses = [e for e in events if e['type'] == 'weather']
+        self.calls = 0
+
+    def fetch(self, position: Position, units='metric', **kwargs) -> bytes:
+        self.calls += 1
+        key = (round(position.lat, 2), round(position.lon, 2), units)
+        responses = [e for e in self.responses
+                     if (round(e['lat'], 2), round(e['lon'], 2), e['units']) == key] or self.responses
+        if not responses:
+            raise Exception('No weather recorded')
+        now = timesource.time()
+        past = [e for e in responses if e['t'] <= now]
+        return (past[-1] if past else responses[0])['body'].encode('utf-8')
+
+    def query(self, position: Position, units='metric', **kwargs):
+        return WeatherInfo(json.loads(self.fetch(position, units, **kwargs)))
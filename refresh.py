@@ -0,0 +1,179 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import threading
+import traceback
+
+import metrics
+import profiler
+import timesource
+
+
+class Request:
+    def __init__(self, priority, reason, target=None):
+        self.priority = priority
+        self.reason = reason
+        self.requested_at = timesource.monotonic()
+        # wall clock time the frame is drawn for, None to draw it right away
+        self.target = target
+        self.buffers = None
+        self.state_key = None
+
+
+class RefreshQueue:
+    """Owns the display: all drawing happens on the queue's thread.
+
+       Requests are coalesced, every draw shows the latest state, so one draw satisfies all
+       requests made before it started. Coalesced request has the highest priority of its parts.
+       Requests made while display is still refreshing are deferred until it is ready.
+
+       Frames for a known time (e.g. the next minute) are rendered ahead into the spare
+       buffers and pushed to the panel as soon as that time comes"""
+    USER = 0
+    PERIODIC = 1
+
+    def __init__(self, layout):
+        self.layout = layout
+        self._cond = threading.Condition()
+        self._pending = None
+        self._ahead = None
+        self._running = False
+        self._thread = None
+        self.last_latency = None
+        self.max_latency = {self.USER: 0.0, self.PERIODIC: 0.0}
+        # delay between the target time and the start of the panel refresh
+        self.last_lag = None
+        self.max_lag = 0.0
+
+    def request(self, priority=PERIODIC, reason=''):
+        with self._cond:
+            if self._pending is None:
+                self._pending = Request(priority, reason)
+            elif priority < self._pending.priority:
+                self._pending.priority = priority
+                self._pending.reason = reason
+            self._cond.notify()
+
+    def request_at(self, target, reason=''):
+        """Requests the frame for the wall clock time target, which is rendered right away
+           and shown at target. Replaces the previous request for a future frame"""
+        with self._cond:
+            self._ahead = Request(self.PERIODIC, reason, target)
+            self._cond.notify()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _next_request(self):
+        """Returns the request to draw now, the future frame request to render ahead
+           or the future frame request which target time has come"""
+        with self._cond:
+            while self._running:
+                ahead = self._ahead
+                if self._pending is not None:
+                    delay = self.layout.display.refresh_delay()
+                    if delay > 0:
+                        # display is busy, wait and let more requests coalesce
+                        timesource.wait(self._cond, delay)
+                        continue
+                    request = self._pending
+                    self._pending = None
+                    if ahead is not None and ahead.target <= timesource.time():
+                        # frame drawn now covers the future frame as well
+                        self._ahead = None
+                    return request
+                if ahead is not None:
+                    if ahead.buffers is None:
+                        return ahead
+                    delay = max(ahead.target - timesource.time(),
+                                self.layout.display.refresh_delay())
+                    if delay > 0:
+                        timesource.wait(self._cond, delay)
+                        continue
+                    self._ahead = None
+                    return ahead
+                self._cond.wait()
+            return None
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                return
+            try:
+                if request.target is None:
+                    profiler.profile(profiler.FRAME, self._draw, request)
+                elif request.buffers is None:
+                    # rendering ahead is profiled with the frame it is shown in
+                    profiler.profile(profiler.FRAME, self._render_ahead,
+                                     request, count=False)
+                else:
+                    profiler.profile(profiler.FRAME,
+                                     self._show_ahead, request)
+            except Exception:
+                print(f'Failed to refresh display for {request.reason}')
+                traceback.print_exc()
+
+    def _draw(self, request):
+        latency = timesource.monotonic() - request.requested_at
+        self.last_latency = latency
+        self.max_latency[request.priority] = max(
+            self.max_latency[request.priority], latency)
+        if latency > 1:
+            print(
+                f'refresh for {request.reason} waited {latency:.1f}s in queue')
+        self.layout.draw()
+        if request.priority == self.USER:
+            metrics.BUTTON_LATENCY_SECONDS.observe(
+                timesource.monotonic() - request.requested_at)
+        with self._cond:
+            if self._ahead is not None:
+                # spare buffers holding the future frame were reused for this one
+                self._ahead.buffers = None
+
+    def _render_ahead(self, request):
+        with self.layout.lock:
+            request.state_key = self.layout.state_key()
+            request.buffers = self.layout.render(
+                datetime.datetime.fromtimestamp(request.target))
+
+    def _show_ahead(self, request):
+        buffers = request.buffers
+        if self.layout.state_key() != request.state_key:
+            # weather or screen state changed since the frame was rendered
+            buffers = self.layout.render(
+                datetime.datetime.fromtimestamp(request.target))
+        lag = timesource.time() - request.target
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag > 1:
+            print(f'refresh for {request.reason} is {lag:.1f}s late')
+        self.layout.display.show(buffers)
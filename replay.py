@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Replays a recording made with "record" config option on virtual time, against
+# the headless display:
+#
+#    ./replay.py recording.jsonl [--speed 1000] [--hours 24] [--output /tmp/frames]
+#
+# Render and refresh times of every frame and memory growth are reported as it runs.
+
+import os
+import sys
+import copy
+import time
+import argparse
+import datetime
+import statistics
+import tracemalloc
+
+import timesource
+from settings import Settings
+from recorder import load, ReplayWeather
+from paperclock import Controller
+from memory import rss
+
+
+class Report:
+    """Collects per-frame timings and memory use"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.render = []
+        self.show = []
+        self.frames = 0
+        self.memory = []  # (virtual time, traced bytes, rss)
+
+    def timed(self, func, timings, label):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                timings.append(elapsed)
+                if self.verbose:
+                    print(f'{timesource.now():%H:%M:%S} {label} {elapsed*1000:8.1f} ms')
+        return wrapper
+
+    def watch(self, screen):
+        screen.layout.render = self.timed(
+            screen.layout.render, self.render, 'render')
+        screen.display.show = self.timed(
+            screen.display.show, self.show, 'show')
+
+    def sample(self):
+        current, _ = tracemalloc.get_traced_memory()
+        self.memory.append((timesource.time(), current, rss()))
+        base = self.memory[0]
+        print(f'{timesource.now():%Y-%m-%d %H:%M} frames {len(self.show):5d}  '
+              f'render {self._ms(self.render)}  show {self._ms(self.show)}  '
+              f'traced {current / 1024:8.0f} KiB ({(current - base[1]) / 1024:+.0f})  '
+              f'rss {self._kib(self.memory[-1][2])}')
+
+    def summary(self):
+        print('Summary:')
+        for name, timings in (('render', self.render), ('show', self.show)):
+            if timings:
+                print(f'  {name:8} frames {len(timings):5d}  min {min(timings)*1000:7.1f} ms  '
+                      f'median {statistics.median(timings)*1000:7.1f} ms  max {max(timings)*1000:7.1f} ms')
+        if len(self.memory) > 1:
+            first, last = self.memory[0], self.memory[-1]
+            hours = max((last[0] - first[0]) / 3600, 1e-9)
+            print(f'  traced memory growth {(last[1] - first[1]) / 1024:+.0f} KiB '
+                  f'({(last[1] - first[1]) / 1024 / hours:+.1f} KiB/hour)')
+            if first[2] is not None and last[2] is not None:
+                print(f'  rss growth {(last[2] - first[2]) / 1024:+.0f} KiB')
+
+    @staticmethod
+    def _ms(timings):
+        if not timings:
+            return '     - ms'
+        return f'{statistics.median(timings)*1000:6.1f} ms'
+
+    @staticmethod
+    def _kib(value):
+        return f'{value / 1024:8.0f} KiB' if value is not None else '-'
+
+
+def replay_settings(settings, output_dir, refresh_latency):
+    """Settings with every display switched to the headless backend and hardware disabled"""
+    config = copy.deepcopy(settings.config)
+    display = {'backend': 'headless', 'refresh_latency': refresh_latency}
+    for index, entry in enumerate([config] + config.get('displays', [])):
+        entry['display'] = dict(display)
+        if output_dir is not None:
+            entry['display']['output_dir'] = os.path.join(
+                output_dir, str(index))
+    for key in ('presence', 'metrics', 'record'):
+        config.pop(key, None)
+    # recorded weather is not added to the history and the state of the live clock
+    config['history'] = None
+    config['state'] = False
+    return Settings(config, settings.config_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded day')
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1000,
+                        help='virtual seconds per real second')
+    parser.add_argument('--hours', type=float,
+                        help='how long to run, till the last recorded event by default')
+    parser.add_argument('--output', help='directory to save frames to')
+    parser.add_argument('--refresh-latency', type=float, default=15,
+                        help='simulated panel refresh time, seconds')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print timings of every frame')
+    args = parser.parse_args()
+
+    events = load(args.recording)
+    if not events:
+        print('Recording is empty')
+        return 1
+    start = events[0]['t']
+    duration = args.hours * 3600 if args.hours is not None else events[-1]['t'] - start + 120
+
+    tracemalloc.start()
+    timesource.use(timesource.VirtualClock(start, args.speed))
+    controller = Controller(replay_settings(
+        Settings(), args.output, args.refresh_latency))
+    controller.openweathermap = ReplayWeather(events)
+    report = Report(args.verbose)
+    for screen in controller.screens:
+        report.watch(screen)
+
+    scheduler = controller.scheduler
+    for event in events:
+        if event['type'] == 'button':
+            scheduler.call_later(event['t'] - start,
+                                 controller.button1pressed, name='replayed button')
+    scheduler.every(3600, report.sample, name='replay report')
+    scheduler.call_later(duration, controller.stop, name='replay end')
+
+    print(f'Replaying {datetime.datetime.fromtimestamp(start)} + {duration / 3600:.1f} hours '
+          f'at {args.speed:.0f}x')
+    controller.run(buttons=False)
+    report.sample()
+    report.summary()
+    print(f'Weather requests: {controller.openweathermap.calls}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
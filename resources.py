@@ -18,32 +18,110 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
+import threading
+
 from PIL import ImageFont, Image
 
+from atlas import Atlas, ATLAS_PATH
+from textcache import TextCache, LRUCache
+from clockface import ClockSprites, sprites_path
+from astronomy import Astronomy
+
 
 class Resources:
-    def __init__(self):
-        self.big_font = ImageFont.FreeTypeFont(
-            font='data/OpenSans-Bold.ttf', size=50)
-        self.med_font = ImageFont.FreeTypeFont(
-            font='data/OpenSans-SemiBold.ttf', size=20)
-        self.small_font = ImageFont.FreeTypeFont(
-            font='data/OpenSans-SemiBold.ttf', size=18)
-        self.tiny_font = ImageFont.FreeTypeFont(
-            font='data/OpenSans-Bold.ttf', size=14)
-
-        self.larger_font = ImageFont.FreeTypeFont(
-            font='data/OpenSans-Bold.ttf', size=25)
-
-        # Icons
-        self.sunrise = Image.open(
-            'data/sunrise.png').convert(mode='1', dither=None)
-        self.sunset = Image.open(
-            'data/sunset.png').convert(mode='1', dither=None)
-
-        self.icons = {}
+    """Fonts and images used for drawing. Everything is loaded on first use.
+
+       Icons are taken from the icon atlas if it was built, otherwise they are loaded from PNG files.
+
+       One instance is shared by all displays, together with text bitmaps, clock sprites and
+       astronomy tables. Drawing with shared resources is serialized by the lock.
+
+       In low memory mode caches are smaller, clock sprites are rendered on demand
+       instead of being loaded from the cache file and trim() releases them"""
+
+    fonts = {
+        'big_font': ('data/OpenSans-Bold.ttf', 50),
+        'med_font': ('data/OpenSans-SemiBold.ttf', 20),
+        'small_font': ('data/OpenSans-SemiBold.ttf', 18),
+        'tiny_font': ('data/OpenSans-Bold.ttf', 14),
+        'larger_font': ('data/OpenSans-Bold.ttf', 25),
+    }
+
+    images = {
+        'sunrise': 'data/sunrise.png',
+        'sunset': 'data/sunset.png',
+    }
+
+    def __init__(self, atlas_path=ATLAS_PATH, low_memory=False):
+        self.low_memory = low_memory
+        self.icons = LRUCache(16 if low_memory else 256)
+        self.lock = threading.RLock()
+        self.text_cache = TextCache(128, 64) if low_memory else TextCache()
+        self.sprites = {}
+        self.astronomies = {}
+        self.atlas = None
+        if atlas_path is not None and os.path.isfile(atlas_path):
+            try:
+                self.atlas = Atlas(atlas_path)
+            except Exception as ex:
+                print(f'Failed to load icon atlas: {ex}')
+
+    def __getattr__(self, name):
+        if name in self.fonts:
+            font, size = self.fonts[name]
+            value = ImageFont.FreeTypeFont(font=font, size=size)
+        elif name in self.images:
+            if self.atlas is not None and name in self.atlas:
+                value = self.atlas.icon(name)
+            else:
+                value = Image.open(self.images[name]).convert(
+                    mode='1', dither=None)
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+    def preload(self):
+        """Loads all fonts and images"""
+        for name in list(self.fonts.keys()) + list(self.images.keys()):
+            getattr(self, name)
+        return self
 
     def icon(self, name: str) -> Image:
-        if name not in self.icons:
-            self.icons[name] = Image.open(f'data/{name}.png').convert(mode='1')
-        return self.icons[name]
+        icon = self.icons.get(name)
+        if icon is None:
+            if self.atlas is not None and name in self.atlas:
+                icon = self.atlas.icon(name)
+            else:
+                icon = Image.open(f'data/{name}.png').convert(mode='1')
+            self.icons.put(name, icon)
+        return icon
+
+    def wind_icon(self, direction) -> Image:
+        """Wind arrow rotated to the wind direction"""
+        if self.atlas is not None:
+            return self.atlas.wind(direction)
+        return self.icon('weather/wind').rotate(direction, fillcolor=1)
+
+    def clock_sprites(self, size, cache_dir=None):
+        if size not in self.sprites:
+            path = sprites_path(cache_dir, size) if not self.low_memory else None
+            self.sprites[size] = ClockSprites(size, path)
+        return self.sprites[size]
+
+    def astronomy(self, position, timezones, cache_dir=None):
+        """Astronomy tables, shared by displays at the same position"""
+        key = (round(position['lat'], 4), round(position['lon'], 4),
+               tuple(timezones), cache_dir)
+        if key not in self.astronomies:
+            self.astronomies[key] = Astronomy(position, timezones, cache_dir)
+        return self.astronomies[key]
+
+    def trim(self):
+        """Releases cached data that is cheap to recreate"""
+        with self.lock:
+            for sprites in self.sprites.values():
+                sprites.evict()
+            self.icons.clear()
+            self.text_cache.bitmaps.clear()
@@ -20,7 +20,6 @@
 
 import json
 import os
-from astral.geocoder import lookup, database
 
 
 class Settings:
@@ -33,23 +32,27 @@ class Settings:
         "secondTZ": "UTC",
         "openweathermap_api_key": None,
         "units": "metric",
-        "time": "24h"
+        "time": "24h",
+        "display": {
+            "backend": "epd2in7b"
+        }
     }
 
     time_formats = {'24h': '%H:%M', '12h': '%I:%M'}
 
-    def __init__(self):
-        try:
-            config = self._load_config()
-        except Exception as ex:
-            print(f'Using default config: {ex}')
-            config = self.default_config
+    def __init__(self, config=None, config_path=None):
+        self.config_path = config_path
+        if config is None:
+            try:
+                config = self._load_config()
+            except Exception as ex:
+                print(f'Using default config: {ex}')
+                config = self.default_config
 
         self.config = config
 
         if isinstance(config['location'], str):
-            location = lookup(config['location'], database())
-            position = {"lat": location.latitude, "lon": location.longitude}
+            position = self._resolve_location(config['location'])
         else:
             position = config['location']
         self.position = position
@@ -60,6 +63,13 @@ class Settings:
         self.time_format_tz = self.time_format + ' %Z'
         self.date_format = '%b %d, %Y'
 
+        # Display backend
+        self.display = config.get('display', self.default_config['display'])
+
+        # Directory for precomputed data, set to null to keep everything in memory
+        self.cache_dir = config.get('cache_dir', os.path.join(
+            os.path.expanduser('~'), '.cache', 'paperclock'))
+
         # self.openweathermap = OpenWeatherMap(
         #     config.get('openweathermap_api_key', None))
 
@@ -70,8 +80,45 @@ class Settings:
             name = os.path.join(os.environ.get('HOME'), '.paperclock')
         with open(name) as config:
             cnf = json.load(config)
+            self.config_path = name
             return cnf
 
+    def _resolve_location(self, name):
+        """Looks up city coordinates. Resolved coordinates are cached next to the config file"""
+        cache_path = self.config_path + \
+            '.locations' if self.config_path is not None else None
+        cache = {}
+        if cache_path is not None and os.path.isfile(cache_path):
+            try:
+                with open(cache_path) as f:
+                    cache = json.load(f)
+            except Exception as ex:
+                print(f'Ignoring location cache: {ex}')
+        if name in cache:
+            return cache[name]
+
+        # geocoder database is slow to load, import it only when needed
+        from astral.geocoder import lookup, database
+        location = lookup(name, database())
+        position = {"lat": location.latitude, "lon": location.longitude}
+        if cache_path is not None:
+            cache[name] = position
+            try:
+                with open(cache_path, 'w') as f:
+                    json.dump(cache, f)
+            except OSError as ex:
+                print(f'Failed to cache location: {ex}')
+        return position
+
+    def displays(self):
+        """Settings for every display. Entries of the "displays" list override top level settings,
+           config without the list describes a single display"""
+        entries = self.config.get('displays', None)
+        if not entries:
+            return [self]
+        common = {k: v for k, v in self.config.items() if k != 'displays'}
+        return [Settings(dict(common, **entry), self.config_path) for entry in entries]
+
     def get(self, name, default):
         return self.config.get(name, default)
 
@@ -0,0 +1,85 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Startup time report. Must be imported before anything else to see all imports:
+#
+#    import startup
+#    startup.enable()
+#    ...
+#    startup.mark('settings loaded')
+#    ...
+#    startup.report()
+
+import sys
+import time
+import builtins
+import threading
+
+_start = time.perf_counter()
+_original_import = builtins.__import__
+_state = threading.local()
+
+enabled = False
+imports = {}  # top-level package -> seconds spent importing it, excluding nested imports
+phases = []  # (name, seconds since start)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # time spent in nested imports is attributed to the nested package, not the importer
+    if level > 0 or (name in sys.modules and not fromlist):
+        return _original_import(name, globals, locals, fromlist, level)
+    stack = getattr(_state, 'stack', None)
+    if stack is None:
+        stack = _state.stack = []
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        root = name.split('.')[0]
+        imports[root] = imports.get(root, 0.0) + elapsed - nested
+
+
+def enable():
+    global enabled
+    enabled = True
+    builtins.__import__ = _timed_import
+
+
+def mark(name):
+    if enabled:
+        phases.append((name, time.perf_counter() - _start))
+
+
+def report(top=15):
+    if not enabled:
+        return
+    print('Startup phases:')
+    previous = 0.0
+    for name, at in phases:
+        print(f'  {name:30} {(at - previous)*1000:9.1f} ms  (at {at*1000:9.1f} ms)')
+        previous = at
+    print('Imports:')
+    for name, duration in sorted(imports.items(), key=lambda i: i[1], reverse=True)[:top]:
+        print(f'  {name:30} {duration*1000:9.1f} ms')
@@ -0,0 +1,107 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Last state of the clock kept across restarts: latest weather responses and hashes of
+# the frames on the displays. E-ink keeps the image without power, so after a reboot
+# the first frame is drawn from this state and not pushed to the panel if it is the same.
+#
+# File layout: header (magic, version, number of displays, number of weather entries),
+# SHA1 hashes of the black and red planes for every display, then weather entries (lat,
+# lon, fetch time, units, zlib compressed response body). Hashes have a fixed offset so
+# they are rewritten in place after every frame, without writing the weather again.
+
+import os
+import zlib
+import struct
+
+_MAGIC = b'PCST'
+_VERSION = 2
+_header = struct.Struct('<4sHHH')
+_weather = struct.Struct('<dddBI')
+_HASH_SIZE = 20
+_NO_HASH = b'\0' * _HASH_SIZE
+
+
+class State:
+    def __init__(self):
+        self.weather = {}  # (lat, lon, units) -> (fetch time, response body)
+        self.hashes = []  # (black, red) plane hashes of every display, None if unknown
+
+
+def _pack_hashes(hashes):
+    data = bytearray()
+    for planes in hashes:
+        for plane in planes:
+            data += plane if plane is not None else _NO_HASH
+    return data
+
+
+def save(path, state: State):
+    data = bytearray(_header.pack(_MAGIC, _VERSION, len(state.hashes), len(state.weather)))
+    data += _pack_hashes(state.hashes)
+    for (lat, lon, units), (fetched, body) in state.weather.items():
+        encoded = units.encode('utf-8')
+        if len(encoded) > 255:
+            raise ValueError(f'units {units!r} are too long')
+        compressed = zlib.compress(body, 9)
+        data += _weather.pack(lat, lon, fetched, len(encoded), len(compressed))
+        data += encoded + compressed
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_hashes(path, hashes):
+    """Rewrites only the frame hashes of the existing file. Raises ValueError if the file
+       isn't a state file for this number of displays"""
+    with open(path, 'r+b') as f:
+        magic, version, display_count, _ = _header.unpack(f.read(_header.size))
+        if magic != _MAGIC or version != _VERSION or display_count != len(hashes):
+            raise ValueError(f'{path} is not a state file for {len(hashes)} displays')
+        f.write(_pack_hashes(hashes))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load(path) -> State:
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, display_count, weather_count = _header.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f'{path} is not a state file')
+    state = State()
+    offset = _header.size
+    for _ in range(display_count):
+        hashes = []
+        for _ in range(2):
+            plane = data[offset:offset + _HASH_SIZE]
+            offset += _HASH_SIZE
+            hashes.append(plane if plane != _NO_HASH else None)
+        state.hashes.append(tuple(hashes))
+    for _ in range(weather_count):
+        lat, lon, fetched, units_length, length = _weather.unpack_from(data, offset)
+        offset += _weather.size
+        units = data[offset:offset + units_length].decode('utf-8')
+        offset += units_length
+        body = zlib.decompress(data[offset:offset + length])
+        offset += length
+        state.weather[(lat, lon, units)] = (fetched, body)
+    return state
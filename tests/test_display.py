@@ -0,0 +1,65 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+from settings import Settings
+from resources import Resources
+from display import Display
+
+STRINGS = ['10.8', 'NNW', 'Humidity: 64%', '12:34', 'Sunny, few clouds']
+
+
+@pytest.fixture
+def display():
+    config = dict(Settings.default_config, display={'backend': 'headless'})
+    display = Display(Settings(config))
+    display.new_screen()
+    return display
+
+
+def expected(display, xy, text, font):
+    image = Image.new('1', display.screen_size, 255)
+    ImageDraw.Draw(image).text(xy, text, font=font, fill=0)
+    return image
+
+
+@pytest.mark.parametrize('width', [65, 66, 100, 101])
+def test_centered_text_matches_image_draw(in_root, display, width):
+    font = Resources().tiny_font
+    for text in STRINGS:
+        display.new_screen()
+        display.draw_text_centered((200, 100), width, text, font, display.BLACK)
+        x = 200 + (width - display.textsize(text, font)[0]) / 2
+        difference = ImageChops.logical_xor(
+            display.buffers[2], expected(display, (x, 100), text, font))
+        assert difference.getbbox() is None, (text, x)
+
+
+def test_text_matches_image_draw(in_root, display):
+    resources = Resources()
+    for font in (resources.tiny_font, resources.med_font, resources.big_font):
+        for text in STRINGS:
+            display.new_screen()
+            display.draw_text((3, 80), text, font, display.BLACK)
+            difference = ImageChops.logical_xor(
+                display.buffers[2], expected(display, (3, 80), text, font))
+            assert difference.getbbox() is None, text
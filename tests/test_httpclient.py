@@ -0,0 +1,151 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import timesource
+from httpclient import HttpClient, retry_after
+
+
+class StubServer:
+    """Local HTTP server answering requests with the queued (status, delay, headers) responses,
+       the last one is repeated"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                status, delay, headers = stub.responses[min(
+                    stub.requests, len(stub.responses)) - 1]
+                time.sleep(delay)
+                body = b'{}'
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass  # client timed out
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def create(*responses):
+        servers.append(StubServer(*responses))
+        return servers[-1]
+
+    yield create
+    for server in servers:
+        server.close()
+
+
+def client(**kwargs):
+    return HttpClient(**dict(dict(connect_timeout=1, read_timeout=1, retries=3, backoff=0.01), **kwargs))
+
+
+def test_retries_server_errors(stub):
+    server = stub((503, 0, {}), (500, 0, {}), (200, 0, {}))
+    response = client().get(server.url)
+    assert response.status_code == 200
+    assert server.requests == 3
+
+
+def test_gives_up_after_retries(stub):
+    server = stub((503, 0, {}))
+    response = client(retries=2).get(server.url)
+    assert response.status_code == 503
+    assert server.requests == 3
+
+
+def test_does_not_retry_client_errors(stub):
+    server = stub((404, 0, {}), (200, 0, {}))
+    response = client().get(server.url)
+    assert response.status_code == 404
+    assert server.requests == 1
+
+
+def test_honors_retry_after(stub):
+    server = stub((429, 0, {'Retry-After': '0.3'}), (200, 0, {}))
+    start = time.monotonic()
+    response = client(backoff=10).get(server.url)
+    assert response.status_code == 200
+    assert 0.3 <= time.monotonic() - start < 5
+
+
+def test_backoff_follows_time_source(stub):
+    server = stub((429, 0, {'Retry-After': '60'}), (200, 0, {}))
+    timesource.use(timesource.VirtualClock(0, speed=1000))
+    try:
+        start = time.monotonic()
+        response = client().get(server.url)
+    finally:
+        timesource.use(timesource.SystemClock())
+    assert response.status_code == 200
+    assert time.monotonic() - start < 1
+
+
+def test_retries_read_timeout(stub):
+    server = stub((200, 0.5, {}), (200, 0, {}))
+    response = client(read_timeout=0.2).get(server.url)
+    assert response.status_code == 200
+    assert server.requests == 2
+
+
+def test_raises_when_timeouts_persist(stub):
+    server = stub((200, 0.5, {}))
+    with pytest.raises(requests.Timeout):
+        client(read_timeout=0.2, retries=1).get(server.url)
+    assert server.requests == 2
+
+
+def test_retry_after_values():
+    class Response:
+        def __init__(self, value):
+            self.headers = {} if value is None else {'Retry-After': value}
+
+    assert retry_after(Response(None)) is None
+    assert retry_after(Response('12')) == 12.0
+    assert retry_after(Response('Wed, 21 Oct 2015 07:28:00 GMT')) == 0.0
+    assert retry_after(Response('soon')) is None
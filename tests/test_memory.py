@@ -0,0 +1,60 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import threading
+
+import pytest
+
+import memory
+from settings import Settings
+from paperclock import Controller
+
+
+@pytest.mark.skipif(memory.rss() is None, reason='RSS is not available')
+def test_soak_rss_stays_flat(in_root):
+    assert memory.soak(1500)
+
+
+@pytest.mark.skipif(memory.rss() is None, reason='RSS is not available')
+def test_soak_low_memory_rss_stays_flat(in_root):
+    assert memory.soak(1500, low_memory=True)
+
+
+def test_attribution_while_drawing(in_root):
+    config = dict(Settings.default_config, display={'backend': 'headless'})
+    controller = Controller(Settings(config))
+    layout = controller.screens[0].layout
+    layout.display.refresh_guard = datetime.timedelta(0)
+    done = threading.Event()
+
+    def draw():
+        while not done.is_set():
+            layout.draw()
+
+    thread = threading.Thread(target=draw)
+    thread.start()
+    try:
+        for _ in range(200):
+            usage = memory.attribution(controller)
+    finally:
+        done.set()
+        thread.join()
+    assert usage['fonts'] > 0 and usage['buffers'] > 0
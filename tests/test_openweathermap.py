@@ -0,0 +1,80 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import threading
+
+import pytest
+
+import openweathermap
+from openweathermap import WeatherInfo, HourlySeries
+from conftest import ROOT
+
+with open(os.path.join(ROOT, 'data', 'onecall-sample.json')) as f:
+    SAMPLE = json.load(f)
+
+
+def test_sections_parsed_once_by_concurrent_readers(monkeypatch):
+    def slow_series(json):
+        # widen the window between reading and storing the parsed section
+        time.sleep(0.05)
+        return HourlySeries(json)
+
+    monkeypatch.setattr(openweathermap, 'HourlySeries', slow_series)
+    weather = WeatherInfo(SAMPLE)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(weather.hourly))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(hourly is results[0] for hourly in results)
+    assert len(results[0]) == len(SAMPLE['hourly'])
+
+
+def test_release_keeps_requested_sections():
+    weather = WeatherInfo(SAMPLE)
+    weather.release(('current', 'minutely'))
+    assert len(weather.minutely_precipitation) == len(SAMPLE['minutely'])
+    assert weather.current.temperature == SAMPLE['current']['temp']
+    assert len(weather.hourly) == 0
+
+
+def test_failed_parse_keeps_raw_section(monkeypatch):
+    def failing_series(json):
+        raise ValueError('broken')
+
+    weather = WeatherInfo(SAMPLE)
+    monkeypatch.setattr(openweathermap, 'HourlySeries', failing_series)
+    with pytest.raises(ValueError):
+        weather.hourly
+    monkeypatch.setattr(openweathermap, 'HourlySeries', HourlySeries)
+    assert len(weather.hourly) == len(SAMPLE['hourly'])
+
+
+def test_missing_current_is_none():
+    data = dict(SAMPLE)
+    del data['current']
+    weather = WeatherInfo(data)
+    assert weather.current is None
+    assert len(weather.hourly) == len(SAMPLE['hourly'])
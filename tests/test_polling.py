@@ -0,0 +1,62 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+
+from polling import PollingPolicy, exclude
+
+KEY = (43.65, -79.38, 'metric')
+NOON = datetime.datetime(2026, 1, 1, 12)
+
+
+def test_night_window():
+    policy = PollingPolicy(daily_budget=100000, night=(0, 6))
+    assert policy.interval(KEY, NOON.replace(hour=3)) == policy.max_interval
+    assert policy.interval(KEY, NOON) == policy.base_interval
+
+
+def test_night_window_wraps_past_midnight():
+    policy = PollingPolicy(daily_budget=100000, night=(22, 6))
+    for hour in (22, 23, 0, 5):
+        assert policy.interval(KEY, NOON.replace(hour=hour)) == policy.max_interval
+    for hour in (6, 12, 21):
+        assert policy.interval(KEY, NOON.replace(hour=hour)) == policy.base_interval
+
+
+def test_failures_back_off_to_normal_interval():
+    policy = PollingPolicy(interval=900, min_interval=300, daily_budget=100000)
+    intervals = []
+    for _ in range(5):
+        policy.record(KEY, None, NOON)
+        intervals.append(policy.interval(KEY, NOON))
+    assert intervals == [300, 600, 900, 900, 900]
+
+
+def test_budget_spreads_remaining_requests():
+    policy = PollingPolicy(interval=60, min_interval=60, daily_budget=10)
+    evening = NOON.replace(hour=22)
+    policy.record(KEY, None, evening)
+    # 9 requests left for the 2 hours till midnight
+    assert policy.interval(KEY, evening) == 7200 / 9
+
+
+def test_exclude():
+    assert exclude({'current', 'minutely', 'hourly'}) == 'daily,alerts'
+    assert exclude({'current', 'minutely', 'hourly', 'daily', 'alerts'}) is None
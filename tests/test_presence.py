@@ -0,0 +1,97 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+
+import pytest
+
+from presence import PresenceSensor, FakeDevice, PRESENT, ABSENT
+
+
+def send_until(device, event, condition, timeout=5):
+    """Sends the event until condition is met, the reader may not have opened the port yet"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        device.send(event)
+        time.sleep(0.05)
+    return True
+
+
+@pytest.fixture
+def devices():
+    devices = []
+    yield devices
+    for device in devices:
+        try:
+            device.close()
+        except OSError:
+            pass
+
+
+def connect(devices):
+    devices.append(FakeDevice())
+    return devices[-1]
+
+
+def test_line_parsing():
+    changes = []
+    sensor = PresenceSensor(None, on_change=changes.append)
+    for line in ('present\n', '  ABSENT \r\n', 'garbage\r\n', '', 'PRESENT extra\r\n'):
+        sensor.feed(line)
+    assert changes == [True, False]
+    assert sensor.present is False
+
+
+def test_repeated_state_reported_once(devices):
+    device = connect(devices)
+    changes = []
+    sensor = PresenceSensor(device.path, on_change=changes.append)
+    sensor.start()
+    try:
+        # the sketch repeats the current state every minute
+        assert send_until(device, PRESENT, lambda: sensor.present is True)
+        for event in (PRESENT, 'noise', PRESENT):
+            device.send(event)
+        assert send_until(device, ABSENT, lambda: sensor.present is False)
+        device.send(ABSENT)
+        time.sleep(0.2)
+    finally:
+        sensor.stop()
+    assert changes == [True, False]
+
+
+def test_reconnects_after_device_is_gone(devices):
+    device = connect(devices)
+    changes = []
+    sensor = PresenceSensor(device.path, on_change=changes.append)
+    sensor.RECONNECT_DELAY = 0.1
+    sensor.start()
+    try:
+        assert send_until(device, PRESENT, lambda: changes == [True])
+        # Arduino is unplugged and shows up again, as a new port here
+        replacement = connect(devices)
+        sensor.port = replacement.path
+        device.close()
+        devices.remove(device)
+        assert send_until(replacement, ABSENT, lambda: changes == [True, False])
+    finally:
+        sensor.stop()
@@ -0,0 +1,47 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import cProfile
+
+import profiler
+
+
+def run_capture(tmp_path, frames=2):
+    assert profiler.start(str(tmp_path), frames=frames, weather=False)
+    results = [profiler.profile(profiler.FRAME, sum, [i, 1]) for i in range(frames)]
+    assert profiler.active is None
+    return results
+
+
+def test_capture_writes_profiles(tmp_path):
+    assert run_capture(tmp_path) == [1, 2]
+    suffixes = sorted(name.split('-')[-1] for name in os.listdir(tmp_path))
+    assert suffixes == ['frame.folded', 'frame.pstats']
+
+
+def test_capture_survives_busy_profiler(tmp_path, monkeypatch):
+    class BusyProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError('Another profiling tool is already active')
+
+    monkeypatch.setattr(profiler.cProfile, 'Profile', BusyProfile)
+    assert run_capture(tmp_path) == [1, 2]
+    assert [name.split('-')[-1] for name in os.listdir(tmp_path)] == ['frame.folded']
@@ -0,0 +1,106 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import datetime
+
+import pytest
+
+import state
+import timesource
+from settings import Settings
+from paperclock import Controller
+from conftest import ROOT
+
+KEY = (43.65, -79.38, 'metric')
+
+with open(os.path.join(ROOT, 'data', 'onecall-sample.json'), 'rb') as f:
+    SAMPLE = f.read()
+
+
+def controller(cache_dir):
+    config = {'location': {'lat': KEY[0], 'lon': KEY[1]}, 'units': KEY[2], 'time': '24h',
+              'cache_dir': str(cache_dir), 'display': {'backend': 'headless'}}
+    return Controller(Settings(config))
+
+
+def save(cache_dir, body, fetched=None, hashes=()):
+    saved = state.State()
+    saved.weather = {KEY: (fetched or timesource.time(), body)}
+    saved.hashes = list(hashes)
+    state.save(os.path.join(cache_dir, 'state.bin'), saved)
+
+
+def test_save_and_load(tmp_path):
+    hashes = [(b'b' * 20, b'r' * 20), (None, None)]
+    save(tmp_path, SAMPLE, 1000.5, hashes)
+    loaded = state.load(os.path.join(tmp_path, 'state.bin'))
+    assert loaded.weather == {KEY: (1000.5, SAMPLE)}
+    assert loaded.hashes == hashes
+
+
+def test_units_are_kept_whole(tmp_path):
+    path = os.path.join(tmp_path, 'state.bin')
+    saved = state.State()
+    saved.weather = {(1.0, 2.0, 'imperial'): (1000.0, b'{}')}
+    state.save(path, saved)
+    assert list(state.load(path).weather) == [(1.0, 2.0, 'imperial')]
+    saved.weather = {(1.0, 2.0, 'x' * 300): (1000.0, b'{}')}
+    with pytest.raises(ValueError):
+        state.save(path, saved)
+
+
+def test_save_hashes_keeps_weather(tmp_path):
+    path = os.path.join(tmp_path, 'state.bin')
+    save(tmp_path, SAMPLE, 1000.5, [(None, None)])
+    state.save_hashes(path, [(b'b' * 20, b'r' * 20)])
+    loaded = state.load(path)
+    assert loaded.hashes == [(b'b' * 20, b'r' * 20)]
+    assert loaded.weather == {KEY: (1000.5, SAMPLE)}
+    with pytest.raises(ValueError):
+        state.save_hashes(path, [(None, None)] * 2)
+
+
+def test_restored_frame_is_not_shown_again(in_root, tmp_path):
+    first = controller(tmp_path)
+    save(tmp_path, SAMPLE)
+    first.restore_state()
+    first.layout.draw(datetime.datetime(2026, 1, 1, 12, 0))
+    now = datetime.datetime(2026, 1, 1, 12, 2)
+    first.layout.display.refresh_guard = datetime.timedelta(0)
+    first.layout.draw(now)
+    # power is cut, stop() doesn't run
+
+    second = controller(tmp_path)
+    second.restore_state()
+    assert second.layout.weather.weather_info is not None
+    assert second.layout.display.last_hashes == first.layout.display.last_hashes
+    assert not second.layout.display.show(second.layout.render(now))
+
+
+def test_broken_or_old_weather_is_ignored(in_root, tmp_path):
+    for body, fetched in ((b'{"current": {"dt": 1', None), (b'{"current": {"dt": 1}}', None),
+                          (b'[1]', None), (SAMPLE, timesource.time() - 24 * 3600)):
+        save(tmp_path, body, fetched)
+        clock = controller(tmp_path)
+        clock.restore_state()
+        assert clock.weather_bodies == {}
+        assert clock.layout.weather.weather_info is None
+        clock.layout.draw()
@@ -0,0 +1,185 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import gzip
+import time
+import threading
+
+import pytest
+import requests
+
+import weatherproxy
+from weatherproxy import StubUpstream, WeatherProxy, create_server
+from openweathermap import OpenWeatherMap, Position
+from httpclient import HttpClient
+from conftest import ROOT
+
+SAMPLE = os.path.join(ROOT, 'data', 'onecall-sample.json')
+
+
+class Clock:
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(weatherproxy.time, 'time', clock.time)
+    return clock
+
+
+@pytest.fixture
+def server():
+    upstream = StubUpstream(SAMPLE)
+    proxy = WeatherProxy(upstream, ttl=600, max_stale=3600)
+    server = create_server(proxy, '127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/onecall'
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    upstream = StubUpstream(SAMPLE, delay=0.3)
+    proxy = WeatherProxy(upstream)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(proxy.get(proxy.key(43.6512, -79.3801))))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert upstream.calls == 1
+    assert len(results) == 5 and all(entry is results[0] for entry in results)
+    assert proxy.stats()['coalesced'] == 4
+
+
+def test_stalled_key_does_not_delay_other_keys():
+    class StalledUpstream(StubUpstream):
+        """Blocks requests for one position until released"""
+
+        def __init__(self, path, stalled_lat):
+            super().__init__(path)
+            self.stalled_lat = stalled_lat
+            self.release = threading.Event()
+
+        def fetch(self, position, units='metric', **kwargs):
+            if position.lat == self.stalled_lat:
+                self.release.wait(10)
+            return super().fetch(position, units, **kwargs)
+
+    upstream = StalledUpstream(SAMPLE, 50.45)
+    proxy = WeatherProxy(upstream)
+    stalled = threading.Thread(target=proxy.get, args=(proxy.key(50.45, 30.52),))
+    stalled.start()
+    try:
+        time.sleep(0.1)
+        start = time.monotonic()
+        assert proxy.get(proxy.key(43.65, -79.38)).body == upstream.body
+        assert time.monotonic() - start < 1
+        assert stalled.is_alive()
+    finally:
+        upstream.release.set()
+        stalled.join()
+    assert upstream.calls == 2
+
+
+def test_nearby_positions_share_entry(clock):
+    upstream = StubUpstream(SAMPLE)
+    proxy = WeatherProxy(upstream, precision=2)
+    assert proxy.key(43.6512, -79.3801) == proxy.key(43.6489, -79.3799)
+    proxy.get(proxy.key(43.6512, -79.3801))
+    proxy.get(proxy.key(43.6489, -79.3799))
+    proxy.get(proxy.key(43.6512, -79.3801, exclude='minutely'))
+    assert upstream.calls == 2
+
+
+def test_entry_expires_after_ttl(clock):
+    upstream = StubUpstream(SAMPLE)
+    proxy = WeatherProxy(upstream, ttl=600)
+    key = proxy.key(43.65, -79.38)
+    proxy.get(key)
+    clock.now += 599
+    proxy.get(key)
+    assert upstream.calls == 1
+    clock.now += 2
+    proxy.get(key)
+    assert upstream.calls == 2
+    assert proxy.stats()['hits'] == 1 and proxy.stats()['misses'] == 2
+
+
+def test_stale_entry_served_while_upstream_fails(clock):
+    upstream = StubUpstream(SAMPLE)
+    proxy = WeatherProxy(upstream, ttl=600, max_stale=3600)
+    key = proxy.key(43.65, -79.38)
+    entry = proxy.get(key)
+    upstream.error = ConnectionError('upstream is down')
+    clock.now += 600 + 3000
+    assert proxy.get(key) is entry
+    clock.now += 1000
+    with pytest.raises(ConnectionError):
+        proxy.get(key)
+    assert proxy.stats()['errors'] == 2
+    upstream.error = None
+    assert proxy.get(key).body == entry.body
+
+
+def test_etag_and_not_modified(server):
+    response = requests.get(url(server), params={'lat': 43.65, 'lon': -79.38})
+    assert response.status_code == 200
+    assert response.content == server.RequestHandlerClass.proxy.upstream.body
+    etag = response.headers['ETag']
+    response = requests.get(url(server), params={'lat': 43.65, 'lon': -79.38},
+                            headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_gzip(server):
+    response = requests.get(url(server), params={'lat': 43.65, 'lon': -79.38},
+                            headers={'Accept-Encoding': 'gzip'}, stream=True)
+    raw = response.raw.read(decode_content=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(raw) == server.RequestHandlerClass.proxy.upstream.body
+
+
+def test_client_reuses_body_on_not_modified(server):
+    client = OpenWeatherMap(None, HttpClient(retries=0), base_url=url(server))
+    first = client.fetch(Position(43.65, -79.38))
+    second = client.fetch(Position(43.65, -79.38))
+    assert first == second == server.RequestHandlerClass.proxy.upstream.body
+    assert server.RequestHandlerClass.proxy.upstream.calls == 1
+
+
+def test_errors(server):
+    assert requests.get(url(server), params={'lat': 'x', 'lon': 1}).status_code == 400
+    server.RequestHandlerClass.proxy.upstream.error = ConnectionError('down')
+    response = requests.get(url(server), params={'lat': 1, 'lon': 1})
+    assert response.status_code == 502
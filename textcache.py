@@ -0,0 +1,127 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+# Strings made only of these characters are composed from cached glyph bitmaps
+# instead of being rasterized as a whole. Digits in the bundled fonts are not kerned,
+# so composed bitmap is identical to the rendered one
+GLYPH_CHARS = frozenset('0123456789:.- ')
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.items.get(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.items)}
+
+
+class TextCache:
+    """Caches text metrics and rendered text bitmaps, keyed by (font, text).
+
+       Bitmaps are mode '1' masks with text pixels set, ready to be pasted into a frame buffer
+       at the integer part of the text position. Like ImageDraw.text, the fractional part
+       (e.g. 0.5 for centered text) is passed to the rasterizer as start, so such bitmaps are
+       cached separately"""
+
+    def __init__(self, max_metrics=512, max_bitmaps=256):
+        self.metrics = LRUCache(max_metrics)
+        self.bitmaps = LRUCache(max_bitmaps)
+        self.glyphs = LRUCache(len(GLYPH_CHARS) * 8)
+
+    def textsize(self, text, font):
+        key = (font, text)
+        size = self.metrics.get(key)
+        if size is None:
+            size = font.getsize(text)
+            self.metrics.put(key, size)
+        return size
+
+    def bitmap(self, text, font, start=(0, 0)):
+        key = (font, text) if start == (0, 0) else (font, text, start)
+        mask = self.bitmaps.get(key)
+        if mask is not None:
+            return mask
+        if start == (0, 0) and GLYPH_CHARS.issuperset(text):
+            # composed strings (mostly times and dates) rarely repeat soon, don't cache them
+            return self._compose(text, font)
+        mask = self._render(text, font, start)
+        self.bitmaps.put(key, mask)
+        return mask
+
+    def stats(self):
+        return {
+            'metrics': self.metrics.stats(),
+            'bitmaps': self.bitmaps.stats(),
+            'glyphs': self.glyphs.stats(),
+        }
+
+    def _render(self, text, font, start=(0, 0)):
+        w, h = self.textsize(text, font)
+        if start != (0, 0):
+            # text shifted by a fraction of pixel can cover one more column or row
+            w, h = w + 1, h + 1
+        mask = Image.new('1', (w, h), 0)
+        ImageDraw.Draw(mask).text(start, text, font=font, fill=1)
+        return mask
+
+    def _glyph(self, ch, font):
+        key = (font, ch)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph = (self._render(ch, font), font.getlength(ch))
+            self.glyphs.put(key, glyph)
+        return glyph
+
+    def _compose(self, text, font):
+        mask = Image.new('1', self.textsize(text, font), 0)
+        x = 0
+        for ch in text:
+            glyph, advance = self._glyph(ch, font)
+            mask.paste(1, (int(x), 0), glyph)
+            x += advance
+        return mask
@@ -0,0 +1,93 @@
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Source of time for the clock. Everything that reads the clock or waits goes through
+# this module, so the whole application can run on virtual time:
+#
+#    timesource.use(VirtualClock(start, speed=1000))
+
+import time as _time
+import datetime
+
+
+class SystemClock:
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+    def wait(self, condition, timeout=None):
+        return condition.wait(timeout)
+
+
+class VirtualClock:
+    """Clock starting at unix time start and running speed times faster than real time"""
+
+    def __init__(self, start, speed=1000.0):
+        self.start = start
+        self.speed = speed
+        self.real_start = _time.monotonic()
+
+    def time(self):
+        return self.start + self.monotonic()
+
+    def monotonic(self):
+        return (_time.monotonic() - self.real_start) * self.speed
+
+    def sleep(self, seconds):
+        _time.sleep(seconds / self.speed)
+
+    def wait(self, condition, timeout=None):
+        return condition.wait(None if timeout is None else timeout / self.speed)
+
+
+source = SystemClock()
+
+
+def use(clock):
+    global source
+    source = clock
+
+
+def time():
+    """Seconds since epoch"""
+    return source.time()
+
+
+def monotonic():
+    return source.monotonic()
+
+
+def now():
+    """Local time as naive datetime"""
+    return datetime.datetime.fromtimestamp(source.time())
+
+
+def sleep(seconds):
+    source.sleep(seconds)
+
+
+def wait(condition, timeout=None):
+    """Waits on the condition for timeout seconds of the clock time"""
+    return source.wait(condition, timeout)
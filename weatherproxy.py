@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright 2020 Oleksiy Voronin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Caching One Call proxy for a fleet of clocks on one network. Clocks point
+# "openweathermap_url" to it, requests for nearby positions share one upstream call:
+#
+#    ./weatherproxy.py [--port 8080] [--ttl 600] [--api-key KEY]
+#
+# Runs without network and API key with a stub upstream serving a saved response:
+#
+#    ./weatherproxy.py --stub data/onecall-sample.json
+
+import sys
+import gzip
+import time
+import hashlib
+import argparse
+import threading
+import traceback
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openweathermap import OpenWeatherMap, Position
+
+
+class StubUpstream:
+    """Upstream serving a saved response for any position"""
+
+    def __init__(self, path, delay=0.0):
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        self.delay = delay
+        self.calls = 0
+        self.error = None  # raised instead of responding when set, e.g. to see stale responses served
+
+    def fetch(self, position: Position, units='metric', **kwargs) -> bytes:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.body
+
+
+class Entry:
+    __slots__ = ('body', 'gzipped', 'etag', 'fetched', 'expires')
+
+    def __init__(self, body, ttl):
+        self.body = body
+        self.gzipped = gzip.compress(body)
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.fetched = time.time()
+        self.expires = self.fetched + ttl
+
+
+class WeatherProxy:
+    """Caches upstream responses by rounded position for ttl seconds.
+
+       Concurrent requests for the same key wait for one upstream call. If upstream
+       fails, expired response is served for up to max_stale seconds"""
+
+    def __init__(self, upstream, ttl=600, precision=2, max_stale=3600):
+        self.upstream = upstream
+        self.ttl = ttl
+        self.precision = precision
+        self.max_stale = max_stale
+        self.entries = {}
+        self.inflight = {}  # key -> Event set when the upstream call finishes
+        self.lock = threading.Lock()
+        # key -> Lock held during upstream calls for the key. ETag state of the upstream client is
+        # per request, so calls for different keys run concurrently and one slow key doesn't block others
+        self.upstream_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def key(self, lat, lon, units='metric', exclude=None):
+        return (round(lat, self.precision), round(lon, self.precision), units, exclude)
+
+    def get(self, key) -> Entry:
+        while True:
+            with self.lock:
+                entry = self.entries.get(key, None)
+                if entry is not None and entry.expires > time.time():
+                    self.hits += 1
+                    return entry
+                done = self.inflight.get(key, None)
+                if done is None:
+                    done = self.inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # another request is fetching the same key
+            done.wait()
+            with self.lock:
+                entry = self.entries.get(key, None)
+                if entry is not None and entry.fetched + self.ttl + self.max_stale > time.time():
+                    self.coalesced += 1
+                    return entry
+            # upstream call failed, try again
+        try:
+            return self._fetch(key)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            done.set()
+
+    def _fetch(self, key):
+        lat, lon, units, exclude = key
+        kwargs = {'exclude': exclude} if exclude is not None else {}
+        with self.lock:
+            upstream_lock = self.upstream_locks.setdefault(
+                key, threading.Lock())
+        try:
+            with upstream_lock:
+                body = self.upstream.fetch(
+                    Position(lat, lon), units, **kwargs)
+        except Exception:
+            self.errors += 1
+            with self.lock:
+                entry = self.entries.get(key, None)
+            if entry is not None and entry.fetched + self.ttl + self.max_stale > time.time():
+                print(f'Upstream failed, serving stale response for {key}')
+                return entry
+            raise
+        entry = Entry(body, self.ttl)
+        with self.lock:
+            self.entries[key] = entry
+            self._evict()
+        return entry
+
+    def _evict(self):
+        now = time.time()
+        for key in [key for key, entry in self.entries.items()
+                    if entry.fetched + self.ttl + self.max_stale < now]:
+            del self.entries[key]
+            if key not in self.inflight:
+                self.upstream_locks.pop(key, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                'errors': self.errors, 'size': len(self.entries)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    proxy: WeatherProxy = None
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            key = self.proxy.key(float(query['lat'][0]), float(query['lon'][0]),
+                                 query.get('units', ['metric'])[0],
+                                 query.get('exclude', [None])[0])
+        except (KeyError, ValueError):
+            self.send_error(400, 'lat and lon are required')
+            return
+        try:
+            entry = self.proxy.get(key)
+        except Exception as ex:
+            traceback.print_exc()
+            self.send_error(502, f'Upstream failed: {ex}')
+            return
+
+        max_age = max(0, int(entry.expires - time.time()))
+        if self.headers.get('If-None-Match', None) == entry.etag:
+            self.send_response(304)
+            self.send_header('ETag', entry.etag)
+            self.send_header('Cache-Control', f'max-age={max_age}')
+            self.end_headers()
+            return
+        body = entry.body
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = entry.gzipped
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', entry.etag)
+        self.send_header('Cache-Control', f'max-age={max_age}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(proxy, address='0.0.0.0', port=8080):
+    handler = type('Handler', (_Handler,), {'proxy': proxy})
+    server = ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Caching OpenWeatherMap proxy')
+    parser.add_argument('--address', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ttl', type=int, default=600,
+                        help='seconds responses are cached for')
+    parser.add_argument('--precision', type=int, default=2,
+                        help='decimal places positions are rounded to')
+    parser.add_argument('--api-key', help='OpenWeatherMap API key, taken from the clock config by default')
+    parser.add_argument('--upstream', default=OpenWeatherMap.BASE_URL)
+    parser.add_argument('--stub', metavar='JSON',
+                        help='serve the saved response instead of calling OpenWeatherMap')
+    args = parser.parse_args()
+
+    if args.stub is not None:
+        upstream = StubUpstream(args.stub)
+    else:
+        api_key = args.api_key
+        if api_key is None:
+            from settings import Settings
+            api_key = Settings().openweathermap_api_key
+        upstream = OpenWeatherMap(api_key, base_url=args.upstream)
+
+    proxy = WeatherProxy(upstream, args.ttl, args.precision)
+    server = create_server(proxy, args.address, args.port)
+    print(f'Serving on {args.address}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(f'Cache stats: {proxy.stats()}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())